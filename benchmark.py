@@ -0,0 +1,223 @@
+import sys
+import json
+import math
+import time
+import platform
+import argparse
+import itertools
+import tracemalloc
+import numpy as np
+from gym import spaces
+
+from gym_multigrid.multigrid import Grid
+from gym_multigrid.envs.collect_game import CollectGameEnv
+from gym_multigrid.envs.soccer_game import SoccerGameEnv
+
+parser = argparse.ArgumentParser(description='Benchmark the multigrid environments')
+parser.add_argument('-o', '--output', default='benchmark.json', type=str, help='file to write the results to')
+parser.add_argument('-c', '--compare', default=None, type=str, help='baseline results to compare with')
+parser.add_argument('-t', '--tolerance', default=0.1, type=float, help='relative slowdown flagged as a regression')
+parser.add_argument('--games', default='collect,soccer', type=str)
+parser.add_argument('--sizes', default='10,20', type=str)
+parser.add_argument('--agents', default='2,4', type=str)
+parser.add_argument('--view-sizes', default='3,7', type=str)
+parser.add_argument('--steps', default=500, type=int)
+parser.add_argument('--resets', default=50, type=int)
+parser.add_argument('--frames', default=20, type=int)
+parser.add_argument('--memory-envs', default=20, type=int)
+parser.add_argument('--repeat', default=3, type=int, help='timings keep the best of this many runs')
+parser.add_argument('--quick', action='store_true', help='small sweep with few iterations')
+
+args = parser.parse_args()
+
+# Whether a larger value of each metric is better
+METRICS = {
+    'steps_per_sec': True,
+    'resets_per_sec': True,
+    'obs_us': False,
+    'render_cold_fps': True,
+    'render_warm_fps': True,
+    'memory_per_env_kb': False,
+    'objects_per_env': False
+}
+
+def make_env(game, size, n_agents, view_size, see_through_walls, partial_obs):
+    teams = [1 + k % 2 for k in range(n_agents)]
+
+    if game == 'collect':
+        env = CollectGameEnv(
+            size=size,
+            num_balls=[size // 2],
+            agents_index=teams,
+            balls_index=[0],
+            balls_reward=[1],
+            zero_sum=True,
+            view_size=view_size
+        )
+    else:
+        env = SoccerGameEnv(
+            size=size,
+            view_size=view_size,
+            goal_pst=[[1, size // 2], [size - 2, size // 2]],
+            goal_index=[1, 2],
+            num_balls=[1],
+            agents_index=teams,
+            balls_index=[0],
+            zero_sum=True
+        )
+
+    env.see_through_walls = see_through_walls
+    if not partial_obs:
+        env.partial_obs = False
+        env.observation_space = spaces.Box(
+            low=0,
+            high=255,
+            shape=(env.width, env.height, env.objects.encode_dim),
+            dtype='uint8'
+        )
+
+    env.seed(0)
+    env.reset()
+
+    return env
+
+def timed(fn, n):
+    """
+    Best time of calling a function n times, over args.repeat runs
+    """
+
+    best = math.inf
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for _ in range(n):
+            fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench(config):
+    env = make_env(**config)
+    rng = np.random.RandomState(0)
+    actions = rng.randint(0, env.action_space.n, size=(args.steps, len(env.agents)))
+
+    def run():
+        for a in actions:
+            _, _, done, _ = env.step(a)
+            if done:
+                env.reset()
+
+    steps_time = timed(run, 1)
+
+    resets_time = timed(env.reset, args.resets)
+    obs_time = timed(env.get_obs, args.steps)
+
+    # Cold frames render every tile again, warm frames hit the tile cache
+    def cold_frame():
+        Grid.tile_cache.clear()
+        env.render(mode='rgb_array', highlight=True)
+
+    cold_time = timed(cold_frame, args.frames)
+    warm_time = timed(lambda: env.render(mode='rgb_array', highlight=True), args.frames)
+
+    # Memory held by envs once they are reset
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    envs = [make_env(**config) for _ in range(args.memory_envs)]
+    memory = (tracemalloc.get_traced_memory()[0] - before) / len(envs)
+    tracemalloc.stop()
+
+    # Distinct objects in the grid of an env, static objects are shared
+    objects = len(set(id(v) for v in envs[0].grid.grid if v is not None))
+    del envs
+
+    return {
+        'steps_per_sec': args.steps / steps_time,
+        'resets_per_sec': args.resets / resets_time,
+        'obs_us': obs_time / args.steps * 1e6,
+        'render_cold_fps': args.frames / cold_time,
+        'render_warm_fps': args.frames / warm_time,
+        'memory_per_env_kb': memory / 1024,
+        'objects_per_env': objects
+    }
+
+def config_key(config):
+    return '{game}-s{size}-a{n_agents}-v{view_size}-{walls}-{obs}'.format(
+        walls='see' if config['see_through_walls'] else 'occlude',
+        obs='partial' if config['partial_obs'] else 'full',
+        **config
+    )
+
+def sweep():
+    ints = lambda s: [int(x) for x in s.split(',')]
+    games = args.games.split(',')
+    sizes, agents, view_sizes = ints(args.sizes), ints(args.agents), ints(args.view_sizes)
+
+    for game, size, n_agents, partial_obs in itertools.product(games, sizes, agents, (True, False)):
+        # The full observations do not depend on the view
+        views = itertools.product(view_sizes, (False, True)) if partial_obs else [(view_sizes[0], False)]
+        for view_size, see_through_walls in views:
+            yield {
+                'game': game,
+                'size': size,
+                'n_agents': n_agents,
+                'view_size': view_size,
+                'see_through_walls': see_through_walls,
+                'partial_obs': partial_obs
+            }
+
+def compare(results, baseline):
+    """
+    Print the metrics that got worse than the baseline by more than the
+    tolerance, and return whether there are any
+    """
+
+    regressions = 0
+
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            # Baselines from older versions may lack some metrics
+            if metric not in baseline[key]:
+                continue
+            new, old = result[metric], baseline[key][metric]
+            if old <= 0:
+                continue
+            change = (new - old) / old
+            if (change < -args.tolerance) if higher_is_better else (change > args.tolerance):
+                print('REGRESSION {} {}: {:.4g} -> {:.4g} ({:+.1%})'.format(key, metric, old, new, change))
+                regressions += 1
+
+    print('{} regressions in {} configurations'.format(regressions, len(results)))
+
+    return regressions > 0
+
+def main():
+
+    if args.quick:
+        args.sizes, args.agents, args.view_sizes = '10', '2', '7'
+        args.steps, args.resets, args.frames, args.memory_envs = 100, 10, 5, 5
+        args.repeat = 1
+
+    results = {}
+    for config in sweep():
+        key = config_key(config)
+        results[key] = dict(config, **bench(config))
+        print('{:40s} {:8.0f} steps/s {:7.0f} resets/s {:7.1f} us/obs {:6.1f} cold fps {:7.1f} warm fps {:7.1f} kB/env {:5d} objects/env'.format(
+            key, *[results[key][m] for m in METRICS]))
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'results': results
+        }, f, indent=1)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
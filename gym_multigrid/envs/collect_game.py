@@ -42,19 +42,27 @@ class CollectGameEnv(MultiGridEnv):
 
 
 
-    def _gen_grid(self, width, height):
-        self.grid = Grid(width, height)
+    def _gen_template(self, width, height):
+        grid = Grid(width, height, self.world)
 
         # Generate the surrounding walls
-        self.grid.horz_wall(self.world, 0, 0)
-        self.grid.horz_wall(self.world, 0, height-1)
-        self.grid.vert_wall(self.world, 0, 0)
-        self.grid.vert_wall(self.world, width-1, 0)
+        grid.horz_wall(self.world, 0, 0)
+        grid.horz_wall(self.world, 0, height-1)
+        grid.vert_wall(self.world, 0, 0)
+        grid.vert_wall(self.world, width-1, 0)
+
+        return grid
+
+    def _gen_grid(self, width, height):
+        # The walls are the same in every episode
+        self.grid = self.template_grid(width, height)
 
         for number, index, reward in zip(self.num_balls, self.balls_index, self.balls_reward):
             for i in range(number):
                 self.place_obj(Ball(self.world, index, reward))
 
+        self.initial_balls = self.grid.count('ball')
+
         # Randomize the player start position and orientation
         for a in self.agents:
             self.place_agent(a)
@@ -84,6 +92,11 @@ class CollectGameEnv(MultiGridEnv):
 
     def step(self, actions):
         obs, rewards, done, info = MultiGridEnv.step(self, actions)
+
+        # The episode ends once the balls placed at reset are all collected
+        if self.initial_balls > 0 and self.grid.count('ball') == 0:
+            done = True
+
         return obs, rewards, done, info
 
 
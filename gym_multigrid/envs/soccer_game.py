@@ -42,17 +42,28 @@ class SoccerGameEnv(MultiGridEnv):
             agent_view_size=view_size
         )
 
-    def _gen_grid(self, width, height):
-        self.grid = Grid(width, height)
+    def _gen_template(self, width, height):
+        grid = Grid(width, height, self.world)
 
         # Generate the surrounding walls
-        self.grid.horz_wall(self.world, 0, 0)
-        self.grid.horz_wall(self.world, 0, height-1)
-        self.grid.vert_wall(self.world, 0, 0)
-        self.grid.vert_wall(self.world, width-1, 0)
+        grid.horz_wall(self.world, 0, 0)
+        grid.horz_wall(self.world, 0, height-1)
+        grid.vert_wall(self.world, 0, 0)
+        grid.vert_wall(self.world, width-1, 0)
 
+        # The goals have a fixed position
         for i in range(len(self.goal_pst)):
-            self.place_obj(ObjectGoal(self.world,self.goal_index[i], 'ball'), top=self.goal_pst[i], size=[1,1])
+            goal = ObjectGoal(self.world, self.goal_index[i], 'ball')
+            pos = np.array(self.goal_pst[i])
+            grid.set(*pos, goal)
+            goal.init_pos = pos
+            goal.cur_pos = pos
+
+        return grid
+
+    def _gen_grid(self, width, height):
+        # The walls and goals are the same in every episode
+        self.grid = self.template_grid(width, height)
 
         for number, index in zip(self.num_balls, self.balls_index):
             for i in range(number):
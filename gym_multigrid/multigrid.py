@@ -1,16 +1,21 @@
 import math
+import time
 import gym
 from enum import IntEnum
 import numpy as np
 from gym import error, spaces, utils
 from gym.utils import seeding
 from .rendering import *
-from .window import Window
+from .views import encode_views, gather_views, process_vis, rotated_windows, view_coords, window_views
 import numpy as np
 
 # Size in pixels of a tile in the full-scale human view
 TILE_PIXELS = 32
 
+# Number of draws over the whole rectangle tried by place_obj before it
+# lists the empty cells
+PLACE_DRAWS = 8
+
 # Map of color names to RGB values
 COLORS = {
     'red': np.array([255, 0, 0]),
@@ -23,6 +28,19 @@ COLORS = {
 
 COLOR_NAMES = sorted(list(COLORS.keys()))
 
+def counter_rng(seed, env_id, episode, step):
+    """
+    Counter-based random stream of a step of an episode of an env: a
+    RandomState drawing from a Philox generator keyed by (seed, env_id)
+    whose counter starts at (episode, step). Any step of any env can be
+    reproduced on its own from these four integers.
+    """
+
+    key = np.array([seed, env_id], dtype=np.uint64)
+    counter = np.array([0, step, episode, 0], dtype=np.uint64)
+
+    return np.random.RandomState(np.random.Philox(key=key, counter=counter))
+
 class World:
 
     encode_dim = 6
@@ -105,11 +123,21 @@ DIR_TO_VEC = [
 ]
 
 
+# Encoding tuples shared by the objects
+ENCODINGS = {}
+
 class WorldObj:
     """
     Base class for grid world objects
+
+    The objects keep their attributes in slots, so subclasses declare the
+    attributes they add in their own __slots__. The encoding of an object
+    is computed on first use and cached, subclasses whose encoding depends
+    on their state reset the cache with invalidate() when it changes.
     """
 
+    __slots__ = ('type', 'color', 'contains', 'init_pos', 'cur_pos', '_encoding', '_encoded_world')
+
     def __init__(self, world, type, color):
         assert type in world.OBJECT_TO_IDX, type
         assert color in world.COLOR_TO_IDX, color
@@ -123,6 +151,14 @@ class WorldObj:
         # Current position of the object
         self.cur_pos = None
 
+        # Encoding tuple of the last encode() and its world
+        self._encoding = None
+        self._encoded_world = None
+
+    def invalidate(self):
+        """Forget the cached encoding after a change of state"""
+        self._encoding = None
+
     def can_overlap(self):
         """Can the agent overlap with this?"""
         return False
@@ -144,7 +180,16 @@ class WorldObj:
         return False
 
     def encode(self, world, current_agent=False):
-        """Encode the a description of this object as a 3-tuple of integers"""
+        """Encode the a description of this object as a tuple of integers"""
+        if self._encoding is None or self._encoded_world is not world:
+            # Equal encodings share a single tuple
+            encoding = self._encode(world)
+            self._encoding = ENCODINGS.setdefault(encoding, encoding)
+            self._encoded_world = world
+        return self._encoding
+
+    def _encode(self, world):
+        """Compute the encoding cached by encode()"""
         if world.encode_dim==3:
             return (world.OBJECT_TO_IDX[self.type], world.COLOR_TO_IDX[self.color], 0)
         else:
@@ -160,6 +205,8 @@ class WorldObj:
 
 
 class ObjectGoal(WorldObj):
+    __slots__ = ('target_type', 'index', 'reward')
+
     def __init__(self, world, index, target_type='ball', reward=1, color=None):
         if color is None:
             super().__init__(world, 'objgoal', world.IDX_TO_COLOR[index])
@@ -177,6 +224,8 @@ class ObjectGoal(WorldObj):
 
 
 class Goal(WorldObj):
+    __slots__ = ('index', 'reward')
+
     def __init__(self, world, index, reward=1, color=None):
         if color is None:
             super().__init__(world, 'goal', world.IDX_TO_COLOR[index])
@@ -192,6 +241,8 @@ class Goal(WorldObj):
         fill_coords(img, point_in_rect(0, 1, 0, 1), COLORS[self.color])
 
 class Switch(WorldObj):
+    __slots__ = ()
+
     def __init__(self, world):
         super().__init__(world, 'switch', world.IDX_TO_COLOR[0])
 
@@ -207,6 +258,8 @@ class Floor(WorldObj):
     Colored floor tile the agent can walk over
     """
 
+    __slots__ = ()
+
     def __init__(self, world, color='blue'):
         super().__init__(world, 'floor', color)
 
@@ -227,6 +280,8 @@ class Floor(WorldObj):
 
 
 class Lava(WorldObj):
+    __slots__ = ()
+
     def __init__(self, world):
         super().__init__(world, 'lava', 'red')
 
@@ -250,6 +305,8 @@ class Lava(WorldObj):
 
 
 class Wall(WorldObj):
+    __slots__ = ()
+
     def __init__(self, world, color='grey'):
         super().__init__(world, 'wall', color)
 
@@ -260,12 +317,56 @@ class Wall(WorldObj):
         fill_coords(img, point_in_rect(0, 1, 0, 1), COLORS[self.color])
 
 
+# Classes of the static objects, which can be shared between cells
+STATIC_OBJS = (Wall, Lava, Floor)
+
+# Shared static objects keyed by class, world and color
+_shared_objs = {}
+
+def shared_obj(cls, world, color=None):
+    """
+    Instance of a static object class (wall, lava or floor) shared by all
+    the grids of the process. Shared objects must never be modified, so
+    they are put in grids with set() but not with put_obj() or place_obj(),
+    which record their position.
+    """
+
+    key = (cls, world, color)
+    obj = _shared_objs.get(key)
+
+    if obj is None:
+        obj = cls(world) if color is None else cls(world, color)
+        _shared_objs[key] = obj
+
+    return obj
+
+
 class Door(WorldObj):
+    __slots__ = ('_is_open', '_is_locked')
+
     def __init__(self, world, color, is_open=False, is_locked=False):
         super().__init__(world, 'door', color)
         self.is_open = is_open
         self.is_locked = is_locked
 
+    @property
+    def is_open(self):
+        return self._is_open
+
+    @is_open.setter
+    def is_open(self, is_open):
+        self._is_open = is_open
+        self._encoding = None
+
+    @property
+    def is_locked(self):
+        return self._is_locked
+
+    @is_locked.setter
+    def is_locked(self, is_locked):
+        self._is_locked = is_locked
+        self._encoding = None
+
     def can_overlap(self):
         """The agent can only walk over this cell when the door is open"""
         return self.is_open
@@ -285,9 +386,7 @@ class Door(WorldObj):
         self.is_open = not self.is_open
         return True
 
-    def encode(self, world, current_agent=False):
-        """Encode the a description of this object as a 3-tuple of integers"""
-
+    def _encode(self, world):
         # State, 0: open, 1: closed, 2: locked
         if self.is_open:
             state = 0
@@ -324,6 +423,8 @@ class Door(WorldObj):
 
 
 class Key(WorldObj):
+    __slots__ = ()
+
     def __init__(self, world, color='blue'):
         super(Key, self).__init__(world, 'key', color)
 
@@ -346,6 +447,8 @@ class Key(WorldObj):
 
 
 class Ball(WorldObj):
+    __slots__ = ('index', 'reward')
+
     def __init__(self, world, index=0, reward=1):
         super(Ball, self).__init__(world, 'ball', world.IDX_TO_COLOR[index])
         self.index = index
@@ -359,6 +462,8 @@ class Ball(WorldObj):
 
 
 class Box(WorldObj):
+    __slots__ = ()
+
     def __init__(self, world, color, contains=None):
         super(Box, self).__init__(world, 'box', color)
         self.contains = contains
@@ -383,6 +488,8 @@ class Box(WorldObj):
 
 
 class Agent(WorldObj):
+    __slots__ = ('pos', '_dir', 'init_dir', 'index', 'view_size', '_carrying', 'terminated', 'started', 'paused')
+
     def __init__(self, world, index=0, view_size=7):
         super(Agent, self).__init__(world, 'agent', world.IDX_TO_COLOR[index])
         self.pos = None
@@ -394,6 +501,24 @@ class Agent(WorldObj):
         self.started = True
         self.paused = False
 
+    @property
+    def dir(self):
+        return self._dir
+
+    @dir.setter
+    def dir(self, dir):
+        self._dir = dir
+        self._encoding = None
+
+    @property
+    def carrying(self):
+        return self._carrying
+
+    @carrying.setter
+    def carrying(self, carrying):
+        self._carrying = carrying
+        self._encoding = None
+
     def render(self, img):
         c = COLORS[self.color]
         tri_fn = point_in_triangle(
@@ -406,22 +531,20 @@ class Agent(WorldObj):
         fill_coords(img, tri_fn, c)
 
     def encode(self, world, current_agent=False):
-        """Encode the a description of this object as a 3-tuple of integers"""
+        """Encode the a description of this object as a tuple of integers"""
+        encoding = WorldObj.encode(self, world)
+        if current_agent and world.encode_dim != 3:
+            return encoding[:-1] + (1,)
+        return encoding
+
+    def _encode(self, world):
         if world.encode_dim==3:
             return (world.OBJECT_TO_IDX[self.type], world.COLOR_TO_IDX[self.color], self.dir)
         elif self.carrying:
-            if current_agent:
-                return (world.OBJECT_TO_IDX[self.type], world.COLOR_TO_IDX[self.color], world.OBJECT_TO_IDX[self.carrying.type],
-                        world.COLOR_TO_IDX[self.carrying.color], self.dir, 1)
-            else:
-                return (world.OBJECT_TO_IDX[self.type], world.COLOR_TO_IDX[self.color], world.OBJECT_TO_IDX[self.carrying.type],
-                        world.COLOR_TO_IDX[self.carrying.color], self.dir, 0)
-
+            return (world.OBJECT_TO_IDX[self.type], world.COLOR_TO_IDX[self.color], world.OBJECT_TO_IDX[self.carrying.type],
+                    world.COLOR_TO_IDX[self.carrying.color], self.dir, 0)
         else:
-            if current_agent:
-                return (world.OBJECT_TO_IDX[self.type], world.COLOR_TO_IDX[self.color], 0, 0, self.dir, 1)
-            else:
-                return (world.OBJECT_TO_IDX[self.type], world.COLOR_TO_IDX[self.color], 0, 0, self.dir, 0)
+            return (world.OBJECT_TO_IDX[self.type], world.COLOR_TO_IDX[self.color], 0, 0, self.dir, 0)
 
     @property
     def dir_vec(self):
@@ -530,35 +653,108 @@ class Agent(WorldObj):
 class Grid:
     """
     Represent a grid and operations on it
+
+    The objects are kept in the flat list `grid`, and the state of every
+    cell is mirrored in numpy planes so that encoding, slicing and
+    occupancy checks are array operations:
+    - `encoding`: the (width, height, encode_dim) encoding of every cell
+    - `owner`: the index (team) of the object in every cell
+    - `opaque`: whether the agents can not see behind every cell
+    The planes are updated in place by set(). An object whose state is
+    changed while it stays in its cell (agent turning or carrying, door
+    opening) must have its cell re-encoded with update().
+
+    The positions of the objects are also indexed by type and by type and
+    color, for membership tests and enumeration without scanning the
+    cells. The index is built on first use and then kept up to date by
+    set().
+
+    A copy of the encoding padded with walls, from which the views of the
+    agents are sliced, is likewise built on first use by padded() and
+    then kept up to date by update().
     """
 
-    # Static cache of pre-renderer tiles
-    tile_cache = {}
+    # Static cache of pre-rendered tiles, shared by all the grids
+    tile_cache = TileCache()
 
-    def __init__(self, width, height):
+    def __init__(self, width, height, world=World):
         assert width >= 3
         assert height >= 3
 
         self.width = width
         self.height = height
+        self.world = world
 
         self.grid = [None] * width * height
 
+        self.encoding = np.zeros((width, height, world.encode_dim), dtype='uint8')
+        self.encoding[:, :, 0] = world.OBJECT_TO_IDX['empty']
+        self.owner = np.zeros((width, height), dtype='uint8')
+        self.opaque = np.zeros((width, height), dtype=bool)
+
+        # Positions of the objects keyed by (type, color) and (type, None)
+        self._index = None
+
+        # Padded encoding, its padding and its view windows by view size
+        self._padded = None
+        self._pad = 0
+        self._windows = {}
+
+    def __getstate__(self):
+        # The view windows are views of the padded buffer, which copies
+        # would not share, so both are built again when used
+        state = self.__dict__.copy()
+        state['_padded'] = None
+        state['_pad'] = 0
+        state['_windows'] = {}
+        return state
+
     def __contains__(self, key):
         if isinstance(key, WorldObj):
-            for e in self.grid:
-                if e is key:
-                    return True
+            return any(self.get(*pos) is key for pos in self.positions(key.type, key.color))
         elif isinstance(key, tuple):
-            for e in self.grid:
-                if e is None:
-                    continue
-                if (e.color, e.type) == key:
-                    return True
-                if key[0] is None and key[1] == e.type:
-                    return True
+            color, type = key
+            return self.count(type, color) > 0
         return False
 
+    @property
+    def index(self):
+        """
+        Index of the positions of the objects, built on first use
+        """
+
+        if self._index is None:
+            self._index = {}
+            for idx, v in enumerate(self.grid):
+                if v is not None:
+                    self._index_add(v, (idx % self.width, idx // self.width))
+
+        return self._index
+
+    def _index_add(self, v, pos):
+        for key in ((v.type, None), (v.type, v.color)):
+            if key not in self._index:
+                self._index[key] = set()
+            self._index[key].add(pos)
+
+    def _index_remove(self, v, pos):
+        for key in ((v.type, None), (v.type, v.color)):
+            self._index[key].discard(pos)
+
+    def positions(self, type, color=None):
+        """
+        Positions of the objects of a type, and of a color if given
+        """
+
+        return list(self.index.get((type, color), ()))
+
+    def count(self, type, color=None):
+        """
+        Number of objects of a type, and of a color if given
+        """
+
+        return len(self.index.get((type, color), ()))
+
     def __eq__(self, other):
         grid1 = self.encode()
         grid2 = other.encode()
@@ -567,31 +763,151 @@ class Grid:
     def __ne__(self, other):
         return not self == other
 
-    def copy(self):
-        from copy import deepcopy
-        return deepcopy(self)
+    def copy(self, deep=True):
+        """
+        Copy the grid. A shallow copy has its own cells and planes but
+        shares the objects with this grid, which is only safe for objects
+        that never change state, like the walls of a level template.
+        """
+
+        if deep:
+            from copy import deepcopy
+            return deepcopy(self)
+
+        from copy import copy
+        grid = copy(self)
+        grid.grid = list(self.grid)
+        grid.encoding = self.encoding.copy()
+        grid.owner = self.owner.copy()
+        grid.opaque = self.opaque.copy()
+        grid._index = None if self._index is None else {k: set(v) for k, v in self._index.items()}
+
+        return grid
 
     def set(self, i, j, v):
         assert i >= 0 and i < self.width
         assert j >= 0 and j < self.height
+
+        if self._index is not None:
+            old = self.grid[j * self.width + i]
+            if old is not None:
+                self._index_remove(old, (i, j))
+            if v is not None:
+                self._index_add(v, (i, j))
+
         self.grid[j * self.width + i] = v
+        self.update(i, j)
 
     def get(self, i, j):
         assert i >= 0 and i < self.width
         assert j >= 0 and j < self.height
         return self.grid[j * self.width + i]
 
+    def is_empty(self, i, j):
+        """
+        Check if a cell does not contain any object
+        """
+
+        return self.encoding[i, j, 0] == self.world.OBJECT_TO_IDX['empty']
+
+    def empty_mask(self):
+        """
+        Boolean (width, height) mask of the cells without any object
+        """
+
+        return self.encoding[:, :, 0] == self.world.OBJECT_TO_IDX['empty']
+
+    def update(self, i, j):
+        """
+        Re-encode a cell after a change of state of its object
+        """
+
+        v = self.grid[j * self.width + i]
+
+        if v is None:
+            self.encoding[i, j] = 0
+            self.encoding[i, j, 0] = self.world.OBJECT_TO_IDX['empty']
+            self.owner[i, j] = 0
+            self.opaque[i, j] = False
+        else:
+            self.encoding[i, j] = v.encode(self.world)
+            self.owner[i, j] = getattr(v, 'index', 0)
+            self.opaque[i, j] = not v.see_behind()
+
+        if self._padded is not None:
+            self._padded[i + self._pad, j + self._pad] = self.encoding[i, j]
+
+    def padded(self, pad):
+        """
+        Encoding surrounded by `pad` cells of walls on every side, in a
+        buffer kept up to date by update(). It is built on first use, and
+        again when a larger padding is needed.
+
+        Returns the buffer and its actual padding.
+        """
+
+        if self._padded is None or self._pad < pad:
+            wall = shared_obj(Wall, self.world).encode(self.world)
+            padded = np.empty((self.width + 2 * pad, self.height + 2 * pad, self.world.encode_dim), dtype='uint8')
+            padded[...] = wall
+            padded[pad:pad + self.width, pad:pad + self.height] = self.encoding
+
+            self._padded = padded
+            self._pad = pad
+            self._windows = {}
+
+        return self._padded, self._pad
+
+    def view_windows(self, view_size):
+        """
+        Rotated windows of the padded encoding giving the egocentric views
+        of a size at every position, see rotated_windows()
+        """
+
+        if self._padded is None or self._pad < view_size - 1 or view_size not in self._windows:
+            padded, pad = self.padded(view_size - 1)
+            self._windows[view_size] = rotated_windows(padded, pad, view_size)
+
+        return self._windows[view_size]
+
+    def _from_planes(self, objects, encoding, owner, opaque):
+        """
+        Build a grid of the same world from a (width, height) array of
+        objects and the matching planes
+        """
+
+        grid = Grid(objects.shape[0], objects.shape[1], self.world)
+        grid.grid = objects.T.ravel().tolist()
+        grid.encoding = np.ascontiguousarray(encoding)
+        grid.owner = np.ascontiguousarray(owner)
+        grid.opaque = np.ascontiguousarray(opaque)
+
+        return grid
+
+    def _objects(self):
+        """
+        View of the objects as a (width, height) array
+        """
+
+        objects = np.empty(len(self.grid), dtype=object)
+        objects[:] = self.grid
+
+        return objects.reshape(self.height, self.width).T
+
     def horz_wall(self, world, x, y, length=None, obj_type=Wall):
         if length is None:
             length = self.width - x
+        # Static objects are shared by all the cells
+        obj = shared_obj(obj_type, world) if obj_type in STATIC_OBJS else None
         for i in range(0, length):
-            self.set(x + i, y, obj_type(world))
+            self.set(x + i, y, obj or obj_type(world))
 
     def vert_wall(self, world, x, y, length=None, obj_type=Wall):
         if length is None:
             length = self.height - y
+        obj = shared_obj(obj_type, world) if obj_type in STATIC_OBJS else None
         for j in range(0, length):
-            self.set(x, y + j, obj_type(world))
+            self.set(x, y + j, obj or obj_type(world))
 
     def wall_rect(self, x, y, w, h):
         self.horz_wall(x, y, w)
@@ -604,36 +920,42 @@ class Grid:
         Rotate the grid to the left (counter-clockwise)
         """
 
-        grid = Grid(self.height, self.width)
-
-        for i in range(self.width):
-            for j in range(self.height):
-                v = self.get(i, j)
-                grid.set(j, grid.height - 1 - i, v)
+        # Cell (i, j) goes to (j, width - 1 - i)
+        def rotate(plane):
+            return np.swapaxes(plane[::-1], 0, 1)
 
-        return grid
+        return self._from_planes(
+            rotate(self._objects()),
+            rotate(self.encoding),
+            rotate(self.owner),
+            rotate(self.opaque)
+        )
 
     def slice(self, world, topX, topY, width, height):
         """
         Get a subset of the grid
         """
 
-        grid = Grid(width, height)
+        xs = np.arange(topX, topX + width)
+        ys = np.arange(topY, topY + height)
+        inside = ((xs >= 0) & (xs < self.width))[:, None] & ((ys >= 0) & (ys < self.height))[None, :]
+        xs = np.clip(xs, 0, self.width - 1)[:, None]
+        ys = np.clip(ys, 0, self.height - 1)[None, :]
 
-        for j in range(0, height):
-            for i in range(0, width):
-                x = topX + i
-                y = topY + j
+        objects = self._objects()[xs, ys]
+        encoding = self.encoding[xs, ys]
+        owner = self.owner[xs, ys]
+        opaque = self.opaque[xs, ys]
 
-                if x >= 0 and x < self.width and \
-                        y >= 0 and y < self.height:
-                    v = self.get(x, y)
-                else:
-                    v = Wall(world)
+        # Cells outside of the grid are walls
+        if not inside.all():
+            wall = shared_obj(Wall, world)
+            objects[~inside] = wall
+            encoding[~inside] = wall.encode(self.world)
+            owner[~inside] = 0
+            opaque[~inside] = True
 
-                grid.set(i, j, v)
-
-        return grid
+        return self._from_planes(objects, encoding, owner, opaque)
 
     @classmethod
     def render_tile(
@@ -651,8 +973,9 @@ class Grid:
         key = (*highlights, tile_size)
         key = obj.encode(world) + key if obj else key
 
-        if key in cls.tile_cache:
-            return cls.tile_cache[key]
+        img = cls.tile_cache.get(key)
+        if img is not None:
+            return img
 
         img = np.zeros(shape=(tile_size * subdivs, tile_size * subdivs, 3), dtype=np.uint8)
 
@@ -672,10 +995,40 @@ class Grid:
         img = downsample(img, subdivs)
 
         # Cache the rendered tile
-        cls.tile_cache[key] = img
+        cls.tile_cache.put(key, img)
 
         return img
 
+    @classmethod
+    def prewarm_tiles(cls, world, tile_size=TILE_PIXELS, highlights=None):
+        """
+        Render and cache the tiles of the common objects: empty cells,
+        walls, lava, and the goals, object goals, balls and agents of
+        every color, the agents in all their directions
+        :param highlights: highlight combinations to render the tiles with,
+            by default no highlights
+        """
+
+        if highlights is None:
+            highlights = [[]]
+
+        types = world.OBJECT_TO_IDX
+
+        objs = [None]
+        objs += [obj_cls(world) for name, obj_cls in (('wall', Wall), ('lava', Lava)) if name in types]
+        for index in range(len(world.IDX_TO_COLOR)):
+            objs += [obj_cls(world, index) for name, obj_cls in (('goal', Goal), ('objgoal', ObjectGoal), ('ball', Ball)) if name in types]
+            for dir in range(4):
+                agent = Agent(world, index)
+                agent.dir = dir
+                objs.append(agent)
+
+        for h in highlights:
+            for obj in objs:
+                cls.render_tile(world, obj, h, tile_size)
+
+        return cls.tile_cache.stats()
+
     def render(
             self,
             world,
@@ -684,70 +1037,93 @@ class Grid:
     ):
         """
         Render this grid at a given scale
+
+        Every distinct pair of cell encoding and highlights is rendered
+        once into an atlas of tiles, and the frame is assembled from the
+        atlas with a single gather.
         :param r: target renderer object
         :param tile_size: tile size in pixels
+        :param highlight_masks: lists of the agents highlighting each cell,
+            indexed by cell position
         """
 
-        # Compute the total grid size
-        width_px = self.width * tile_size
-        height_px = self.height * tile_size
-
-        img = np.zeros(shape=(height_px, width_px, 3), dtype=np.uint8)
-
-        # Render the grid
-        for j in range(0, self.height):
-            for i in range(0, self.width):
-                cell = self.get(i, j)
-
-                # agent_here = np.array_equal(agent_pos, (i, j))
-                tile_img = Grid.render_tile(
-                    world,
-                    cell,
-                    highlights=[] if highlight_masks is None else highlight_masks[i, j],
-                    tile_size=tile_size
-                )
+        encoding = self.encoding if world is self.world else self._encode_cells(world)
+        n_channels = encoding.shape[-1]
+
+        # Pack the encoding and the highlights of every cell into one code
+        codes = encoding.reshape(-1, n_channels).astype(np.int64).dot(256 ** np.arange(n_channels))
+        highlights = [()]
+        hids = np.zeros((self.width, self.height), dtype=np.int64)
+        if highlight_masks is not None:
+            highlight_ids = {(): 0}
+            cells = highlight_masks.items() if hasattr(highlight_masks, 'items') else (
+                ((i, j), highlight_masks[i, j]) for i in range(self.width) for j in range(self.height))
+            for (i, j), h in cells:
+                h = tuple(h)
+                if h not in highlight_ids:
+                    highlight_ids[h] = len(highlights)
+                    highlights.append(h)
+                hids[i, j] = highlight_ids[h]
+            codes += hids.ravel() * 256 ** n_channels
+
+        _, first, inverse = np.unique(codes, return_index=True, return_inverse=True)
+
+        # Render the tile of every distinct cell
+        hids = hids.ravel()
+        atlas = np.empty((len(first), tile_size, tile_size, 3), dtype=np.uint8)
+        for k, cell in enumerate(first):
+            i, j = divmod(int(cell), self.height)
+            atlas[k] = Grid.render_tile(
+                world,
+                self.get(i, j),
+                highlights=list(highlights[hids[cell]]),
+                tile_size=tile_size
+            )
 
-                ymin = j * tile_size
-                ymax = (j + 1) * tile_size
-                xmin = i * tile_size
-                xmax = (i + 1) * tile_size
-                img[ymin:ymax, xmin:xmax, :] = tile_img
+        # Gather the tiles of the (width, height) cells and lay them out
+        img = atlas[inverse].reshape(self.width, self.height, tile_size, tile_size, 3)
+        img = img.transpose(1, 2, 0, 3, 4).reshape(self.height * tile_size, self.width * tile_size, 3)
 
         return img
 
-    def encode(self, world, vis_mask=None):
+    def encode(self, world=None, vis_mask=None):
         """
         Produce a compact numpy encoding of the grid
         """
 
+        if world is not None and world is not self.world:
+            return self._encode_cells(world, vis_mask)
+
         if vis_mask is None:
-            vis_mask = np.ones((self.width, self.height), dtype=bool)
+            return self.encoding.copy()
 
-        array = np.zeros((self.width, self.height, world.encode_dim), dtype='uint8')
+        array = np.zeros((self.width, self.height, self.world.encode_dim), dtype='uint8')
+        array[vis_mask] = self.encoding[vis_mask]
 
-        for i in range(self.width):
-            for j in range(self.height):
-                if vis_mask[i, j]:
-                    v = self.get(i, j)
+        return array
 
-                    if v is None:
-                        array[i, j, 0] = world.OBJECT_TO_IDX['empty']
-                        array[i, j, 1] = 0
-                        array[i, j, 2] = 0
-                        if world.encode_dim > 3:
-                            array[i, j, 3] = 0
-                            array[i, j, 4] = 0
-                            array[i, j, 5] = 0
+    def encode_for_agents(self, world, agent_pos, vis_mask=None):
+        """
+        Produce a compact numpy encoding of the grid
+        """
 
-                    else:
-                        array[i, j, :] = v.encode(world)
+        array = self.encode(world, vis_mask)
+
+        # Flag the agent the encoding is produced for
+        world = self.world if world is None else world
+        i, j = agent_pos
+        if world.encode_dim > 3 and (vis_mask is None or vis_mask[i, j]):
+            v = self.get(i, j)
+            if v is not None:
+                array[i, j, :] = v.encode(world, current_agent=True)
 
         return array
 
-    def encode_for_agents(self, world, agent_pos, vis_mask=None):
+    def _encode_cells(self, world, vis_mask=None):
         """
-        Produce a compact numpy encoding of the grid
+        Encode the grid cell by cell in another world than its own
         """
+
         if vis_mask is None:
             vis_mask = np.ones((self.width, self.height), dtype=bool)
 
@@ -760,15 +1136,8 @@ class Grid:
 
                     if v is None:
                         array[i, j, 0] = world.OBJECT_TO_IDX['empty']
-                        array[i, j, 1] = 0
-                        array[i, j, 2] = 0
-                        if world.encode_dim > 3:
-                            array[i, j, 3] = 0
-                            array[i, j, 4] = 0
-                            array[i, j, 5] = 0
-
                     else:
-                        array[i, j, :] = v.encode(world, current_agent=np.array_equal(agent_pos, (i, j)))
+                        array[i, j, :] = v.encode(world)
 
         return array
 
@@ -793,44 +1162,123 @@ class Grid:
     #
     #     return grid, vis_mask
 
+    def clear(self, mask):
+        """
+        Remove the objects from the cells selected by a boolean mask
+        """
+
+        objects = self._objects()
+        objects[mask] = None
+        self.grid = objects.T.ravel().tolist()
+        self._index = None
+
+        self.encoding[mask] = 0
+        self.encoding[mask, 0] = self.world.OBJECT_TO_IDX['empty']
+        self.owner[mask] = 0
+        self.opaque[mask] = False
+
+        if self._padded is not None:
+            p = self._pad
+            self._padded[p:p + self.width, p:p + self.height] = self.encoding
+
     def process_vis(grid, agent_pos):
-        mask = np.zeros(shape=(grid.width, grid.height), dtype=np.bool)
+        mask = process_vis(grid.opaque, agent_pos)
 
-        mask[agent_pos[0], agent_pos[1]] = True
+        # Clear the cells that can not be seen
+        grid.clear(~mask)
 
-        for j in reversed(range(0, grid.height)):
-            for i in range(0, grid.width - 1):
-                if not mask[i, j]:
-                    continue
+        return mask
 
-                cell = grid.get(i, j)
-                if cell and not cell.see_behind():
-                    continue
+class PerfStats:
+    """
+    Time spent in the phases of reset and step, see
+    MultiGridEnv.enable_perf_stats()
 
-                mask[i + 1, j] = True
-                if j > 0:
-                    mask[i + 1, j - 1] = True
-                    mask[i, j - 1] = True
+    For every phase, the number of calls, the cumulative time and the
+    time of the last call are kept, in seconds. Counters (e.g. the
+    placement tries) are kept separately.
+    """
 
-            for i in reversed(range(1, grid.width)):
-                if not mask[i, j]:
-                    continue
+    def __init__(self, in_info=False):
+        self.in_info = in_info
+        self.calls = {}
+        self.total = {}
+        self.last = {}
+        self.counters = {}
 
-                cell = grid.get(i, j)
-                if cell and not cell.see_behind():
-                    continue
+        # Times of the phases of the current reset or step
+        self.current = {}
 
-                mask[i - 1, j] = True
-                if j > 0:
-                    mask[i - 1, j - 1] = True
-                    mask[i, j - 1] = True
+    def add(self, phase, seconds):
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        self.total[phase] = self.total.get(phase, 0) + seconds
+        self.last[phase] = seconds
+        self.current[phase] = seconds
 
-        for j in range(0, grid.height):
-            for i in range(0, grid.width):
-                if not mask[i, j]:
-                    grid.set(i, j, None)
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
 
-        return mask
+    def wrap(self, phase, fn):
+        """
+        Wrap a function so that its calls are timed as a phase
+        """
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.add(phase, time.perf_counter() - start)
+
+        return timed
+
+    def stats(self):
+        return {
+            'phases': {
+                phase: {
+                    'calls': self.calls[phase],
+                    'total': self.total[phase],
+                    'mean': self.total[phase] / self.calls[phase],
+                    'last': self.last[phase]
+                }
+                for phase in self.calls
+            },
+            'counters': dict(self.counters)
+        }
+
+class EnvState:
+    """
+    Snapshot of the state of a MultiGridEnv, see MultiGridEnv.get_state()
+
+    The cells and the grid planes are copied, the objects themselves are
+    shared with the env: the only state they change during an episode
+    (agent positions, directions, flags and carried objects, door states,
+    and the cur_pos of the objects that can be picked up) is stored here.
+    """
+
+    def __init__(self, env):
+        grid = env.grid
+        agents = env.agents
+
+        self.cells = list(grid.grid)
+        self.index = None if grid._index is None else {k: set(v) for k, v in grid._index.items()}
+        self.encoding = grid.encoding.copy()
+        self.owner = grid.owner.copy()
+        self.opaque = grid.opaque.copy()
+
+        self.agent_pos = np.array([a.pos for a in agents])
+        self.agent_dir = np.array([a.dir for a in agents])
+        self.agent_flags = np.array([(a.terminated, a.paused, a.started) for a in agents])
+        self.carrying = [a.carrying for a in agents]
+
+        # The games move the objects picked up and dropped in cur_pos
+        self.obj_pos = [(obj, obj.cur_pos) for obj in self.cells + self.carrying if obj is not None and obj.can_pickup()]
+
+        self.step_count = env.step_count
+        self.episode = env.episode
+
+        # Counter-based streams are derived from the episode and step
+        self.rng_state = env.np_random.get_state() if env.rng_key is None else None
 
 class Actions:
     available=['still', 'left', 'right', 'forward', 'pickup', 'drop', 'toggle', 'done']
@@ -893,7 +1341,8 @@ class MultiGridEnv(gym.Env):
             partial_obs=True,
             agent_view_size=7,
             actions_set=Actions,
-            objects_set = World
+            objects_set = World,
+            obs_dtype=None
     ):
         self.agents = agents
 
@@ -939,6 +1388,17 @@ class MultiGridEnv(gym.Env):
         # Window to use for human rendering mode
         self.window = None
 
+        # Static structure of the levels, built once by _gen_template()
+        self._grid_template = None
+
+        # Timing of the phases of reset and step, None when disabled
+        self.perf = None
+
+        # Preallocated array the observations are written into, if any
+        self.obs_buffer = None
+        if obs_dtype is not None:
+            self.set_obs_buffer(dtype=obs_dtype)
+
         # Environment configuration
         self.width = width
         self.height = height
@@ -952,12 +1412,26 @@ class MultiGridEnv(gym.Env):
         self.reset()
 
     def reset(self):
+        perf = self.perf
+        if perf is not None:
+            # The times of the last step may have been handed out in info
+            perf.current = {}
+            start = time.perf_counter()
+
+        self.episode += 1
+
+        # Step count since episode start
+        self.step_count = 0
+        self._step_rng()
 
         # Generate a new random grid at the start of each episode
         # To keep the same grid for each episode, call env.seed() with
         # the same seed before calling env.reset()
         self._gen_grid(self.width, self.height)
 
+        if perf is not None:
+            perf.add('reset.gen_grid', time.perf_counter() - start)
+
         # These fields should be defined by _gen_grid
         for a in self.agents:
             assert a.pos is not None
@@ -966,23 +1440,200 @@ class MultiGridEnv(gym.Env):
         # Item picked up, being carried, initially nothing
         for a in self.agents:
             a.carrying = None
-
-        # Step count since episode start
-        self.step_count = 0
+            self.grid.update(*a.pos)
 
         # Return first observation
+        obs = self.get_obs()
+
+        if perf is not None:
+            perf.add('reset', time.perf_counter() - start)
+
+        return obs
+
+    def get_state(self):
+        """
+        Snapshot of the full state of the simulator: grid, agents, carried
+        objects, step count and RNG, to be restored with set_state().
+        Snapshots are cheapest with counter-based streams (seed with an
+        env_id), whose RNG state needs no copy.
+        """
+
+        return EnvState(self)
+
+    def set_state(self, state):
+        """
+        Restore a snapshot taken by get_state() during this episode or
+        an earlier one of the same env
+        """
+
+        grid = self.grid
+        assert len(state.cells) == len(grid.grid), "the snapshot is from a grid of another size"
+
+        grid.grid[:] = state.cells
+        grid._index = None if state.index is None else {k: set(v) for k, v in state.index.items()}
+        grid.encoding[...] = state.encoding
+        grid.owner[...] = state.owner
+        grid.opaque[...] = state.opaque
+        grid._padded = None
+
+        # The doors get their state back from the encoding
+        door = grid.world.OBJECT_TO_IDX.get('door')
+        if door is not None:
+            for i, j in zip(*np.nonzero(state.encoding[:, :, 0] == door)):
+                obj = grid.get(i, j)
+                obj.is_open = state.encoding[i, j, 2] == 0
+                obj.is_locked = state.encoding[i, j, 2] == 2
+
+        for n, a in enumerate(self.agents):
+            a.pos = state.agent_pos[n].copy()
+            a.dir = int(state.agent_dir[n])
+            a.terminated, a.paused, a.started = state.agent_flags[n].tolist()
+            a.carrying = state.carrying[n]
+
+        for obj, pos in state.obj_pos:
+            obj.cur_pos = pos
+
+        self.step_count = state.step_count
+        self.episode = state.episode
+
+        # Counter-based streams are set again at the next step
+        if state.rng_state is not None:
+            self.np_random.set_state(state.rng_state)
+
+    def enable_perf_stats(self, enable=True, in_info=False):
+        """
+        Time the phases of reset and step: level generation, action
+        resolution, the _handle_* hooks, the observations (encoding,
+        visibility, normalization) and placement. The timings are read
+        with perf_stats(). Disabled, the instrumentation costs a few
+        attribute checks per step.
+
+        :param in_info: also return the timings of every step in
+            info['perf']
+        """
+
+        hooks = ['_handle_pickup', '_handle_drop', '_handle_build', '_handle_switch', '_handle_special_moves']
+
+        # Remove the timed hooks of a previous call
+        for name in hooks:
+            self.__dict__.pop(name, None)
+
+        self.perf = PerfStats(in_info) if enable else None
+
+        if enable:
+            for name in hooks:
+                setattr(self, name, self.perf.wrap('step.hooks.' + name[len('_handle_'):], getattr(self, name)))
+
+    def perf_stats(self):
+        """
+        Calls, cumulative, mean and last time of every timed phase, and
+        the counters, or None if the timing is disabled
+        """
+
+        return None if self.perf is None else self.perf.stats()
+
+    def set_obs_buffer(self, buffer=None, dtype=np.uint8):
+        """
+        Write the observations of reset and step into a single array of
+        shape (n_agents,) + observation_space.shape instead of returning a
+        new list of arrays. The same array is returned at every call.
+
+        :param buffer: array to write into, allocated by the env if None
+        :param dtype: type of the allocated array. Integer types hold the
+            raw encoding, float types the normalized encoding
+        """
+
+        shape = (len(self.agents),) + self.observation_space.shape
+
+        # The views are all gathered at the size of the buffer
         if self.partial_obs:
-            obs = self.gen_obs()
+            assert all(a.view_size == shape[1] for a in self.agents), \
+                "all the agents must have the view size %d of the observation space" % shape[1]
+
+        if buffer is None:
+            buffer = np.zeros(shape, dtype=dtype)
+        assert buffer.shape == shape, "the buffer must be of shape %s" % (shape,)
+
+        self.obs_buffer = buffer
+
+        # Raw encoding to normalize into a float buffer
+        if np.issubdtype(buffer.dtype, np.floating):
+            self._raw_obs = np.zeros(shape, dtype='uint8')
         else:
-            obs = [self.grid.encode_for_agents(self.agents[i].pos) for i in range(len(self.agents))]
-        obs=[self.objects.normalize_obs*ob for ob in obs]
+            self._raw_obs = buffer
+
+    def get_obs(self):
+        """
+        Observations of the agents, written into the observation buffer
+        if there is one
+        """
+
+        perf = self.perf
+        if perf is not None:
+            start = time.perf_counter()
+
+        if self.obs_buffer is None:
+            obs = self.gen_obs() if self.partial_obs else self.gen_full_obs()
+            if perf is not None:
+                encoded = time.perf_counter()
+
+            if self.partial_obs:
+                obs = [self.objects.normalize_obs*ob for ob in obs]
+            else:
+                obs = self.objects.normalize_obs*obs
+
+        else:
+            if self.partial_obs:
+                self.gen_obs(out=self._raw_obs)
+            else:
+                self.gen_full_obs(out=self._raw_obs)
+            if perf is not None:
+                encoded = time.perf_counter()
+
+            if self._raw_obs is not self.obs_buffer:
+                np.multiply(self._raw_obs, self.objects.normalize_obs, out=self.obs_buffer)
+            obs = self.obs_buffer
+
+        if perf is not None:
+            end = time.perf_counter()
+            perf.add('obs.normalize', end - encoded)
+            perf.add('obs', end - start)
+
         return obs
 
-    def seed(self, seed=1337):
-        # Seed the random number generator
-        self.np_random, _ = seeding.np_random(seed)
+    def seed(self, seed=1337, env_id=None):
+        """
+        Seed the random number generator
+
+        If env_id is given, the randomness of every reset and step is drawn
+        from counter_rng(seed, env_id, episode, step) instead, so that the
+        episodes of the env of a batch can be reproduced by a single env
+        whatever the other envs do
+        """
+
+        self.np_random, seed = seeding.np_random(seed)
+        self.rng_key = None if env_id is None else (seed & 0xffffffffffffffff, env_id)
+
+        # Number of the current episode since seeding
+        self.episode = -1
+
         return [seed]
 
+    def _step_rng(self):
+        """
+        Switch to the counter-based stream of the current episode and step
+        """
+
+        if self.rng_key is not None:
+            self.np_random = counter_rng(*self.rng_key, self.episode, self.step_count)
+
+    def _agent_order(self):
+        """
+        Random order in which the agents act at this step
+        """
+
+        return self.np_random.permutation(len(self.agents))
+
     @property
     def steps_remaining(self):
         return self.max_steps - self.step_count
@@ -1051,6 +1702,30 @@ class MultiGridEnv(gym.Env):
     def _gen_grid(self, width, height):
         assert False, "_gen_grid needs to be implemented by each environment"
 
+    def _gen_template(self, width, height):
+        """
+        Generate the static structure of the levels (walls, fixed goals),
+        which must not depend on the RNG and whose objects must never
+        change state, and return it as a grid
+        """
+        assert False, "_gen_template needs to be implemented to use template_grid"
+
+    def template_grid(self, width, height):
+        """
+        Fresh grid holding the static structure of the levels, generated
+        once by _gen_template() and then copied at every reset. Set
+        _grid_template to None to generate it again.
+        """
+
+        template = self._grid_template
+        if template is None or (template.width, template.height) != (width, height):
+            template = self._grid_template = self._gen_template(width, height)
+            # Built once here, the object index is carried by the copies
+            # instead of being rebuilt from every cell after each reset
+            template.index
+
+        return template.copy(deep=False)
+
     def _handle_pickup(self, i, rewards, fwd_pos, fwd_cell):
         pass
 
@@ -1142,14 +1817,24 @@ class MultiGridEnv(gym.Env):
                   top=None,
                   size=None,
                   reject_fn=None,
-                  max_tries=math.inf
+                  max_tries=math.inf,
+                  vec_reject_fn=None
                   ):
         """
         Place an object at an empty position in the grid
 
+        The position is drawn uniformly among the empty cells of the
+        rectangle. A few draws over the whole rectangle are tried first,
+        which finds a cell without looking at the others on mostly empty
+        grids, then the empty cells are listed and rejected positions are
+        not drawn again, so the number of tries stays bounded.
+
         :param top: top-left position of the rectangle where to place
         :param size: size of the rectangle where to place
         :param reject_fn: function to filter out potential positions
+        :param vec_reject_fn: function to filter out all the potential
+            positions at once, given as arrays of x and y coordinates, by
+            returning a boolean mask of the rejected ones
         """
 
         if top is None:
@@ -1160,31 +1845,33 @@ class MultiGridEnv(gym.Env):
         if size is None:
             size = (self.grid.width, self.grid.height)
 
+        width = min(top[0] + size[0], self.grid.width) - top[0]
+        height = min(top[1] + size[1], self.grid.height) - top[1]
         num_tries = 0
+        pos = None
 
-        while True:
-            # This is to handle with rare cases where rejection sampling
-            # gets stuck in an infinite loop
-            if num_tries > max_tries:
-                raise RecursionError('rejection sampling failed in place_obj')
-
+        # Uniform draws over the rectangle, kept if the cell is acceptable
+        while width > 0 and height > 0 and num_tries < min(PLACE_DRAWS, max_tries):
             num_tries += 1
 
-            pos = np.array((
-                self._rand_int(top[0], min(top[0] + size[0], self.grid.width)),
-                self._rand_int(top[1], min(top[1] + size[1], self.grid.height))
-            ))
-
-            # Don't place the object on top of another object
-            if self.grid.get(*pos) != None:
-                continue
+            k = self._rand_int(0, width * height)
+            pos = np.array((top[0] + k // height, top[1] + k % height))
 
-            # Check if there is a filtering criterion
-            if reject_fn and reject_fn(self, pos):
+            if (not self.grid.is_empty(*pos)
+                    or (vec_reject_fn is not None and vec_reject_fn(self, pos[:1], pos[1:])[0])
+                    or (reject_fn and reject_fn(self, pos))):
+                pos = None
                 continue
 
             break
 
+        if pos is None:
+            pos, num_tries = self._place_among_free(top, width, height, reject_fn, max_tries, vec_reject_fn, num_tries)
+
+        if self.perf is not None:
+            self.perf.count('place_obj.calls')
+            self.perf.count('place_obj.tries', num_tries)
+
         self.grid.set(*pos, obj)
 
         if obj is not None:
@@ -1193,6 +1880,49 @@ class MultiGridEnv(gym.Env):
 
         return pos
 
+    def _place_among_free(self, top, width, height, reject_fn, max_tries, vec_reject_fn, num_tries):
+        """
+        Draw a position among the listed empty cells of a rectangle,
+        returning it with the total number of tries
+        """
+
+        xs, ys = np.nonzero(self.grid.empty_mask()[
+            top[0]:top[0] + max(width, 0),
+            top[1]:top[1] + max(height, 0)
+        ])
+        xs += top[0]
+        ys += top[1]
+
+        if vec_reject_fn is not None:
+            keep = ~np.asarray(vec_reject_fn(self, xs, ys), dtype=bool)
+            xs = xs[keep]
+            ys = ys[keep]
+
+        num_free = len(xs)
+
+        while True:
+            if num_free == 0:
+                raise RecursionError('no empty position left in place_obj')
+
+            # This is to handle with rare cases where rejection sampling
+            # gets stuck in an infinite loop
+            if num_tries > max_tries:
+                raise RecursionError('rejection sampling failed in place_obj')
+
+            num_tries += 1
+
+            k = self._rand_int(0, num_free)
+            pos = np.array((xs[k], ys[k]))
+
+            # Check if there is a filtering criterion
+            if reject_fn and reject_fn(self, pos):
+                # Swap the rejected position out of the candidates
+                num_free -= 1
+                xs[k], ys[k] = xs[num_free], ys[num_free]
+                continue
+
+            return pos, num_tries
+
     def put_obj(self, obj, i, j):
         """
         Put an object at a specific position in the grid
@@ -1215,15 +1945,19 @@ class MultiGridEnv(gym.Env):
         """
 
         agent.pos = None
-        pos = self.place_obj(agent, top, size, max_tries=max_tries)
+        pos = self.place_obj(None, top, size, max_tries=max_tries)
         agent.pos = pos
         agent.init_pos = pos
+        agent.cur_pos = pos
 
         if rand_dir:
             agent.dir = self._rand_int(0, 4)
 
         agent.init_dir = agent.dir
 
+        # The agent is only encoded in the grid once it has a direction
+        self.grid.set(*pos, agent)
+
         return pos
 
     def agent_sees(self, a, x, y):
@@ -1244,9 +1978,15 @@ class MultiGridEnv(gym.Env):
         return obs_cell is not None and obs_cell.type == world_cell.type
 
     def step(self, actions):
+        perf = self.perf
+        if perf is not None:
+            perf.current = {}
+            start = time.perf_counter()
+
         self.step_count += 1
+        self._step_rng()
 
-        order = np.random.permutation(len(actions))
+        order = self._agent_order()
 
         rewards = np.zeros(len(actions))
         done = False
@@ -1309,17 +2049,26 @@ class MultiGridEnv(gym.Env):
             else:
                 assert False, "unknown action"
 
+            # Re-encode the cells the action may have changed in place
+            self.grid.update(*self.agents[i].pos)
+            if 0 <= fwd_pos[0] < self.grid.width and 0 <= fwd_pos[1] < self.grid.height:
+                self.grid.update(*fwd_pos)
+
         if self.step_count >= self.max_steps:
             done = True
 
-        if self.partial_obs:
-            obs = self.gen_obs()
-        else:
-            obs = [self.grid.encode_for_agents(self.agents[i].pos) for i in range(len(actions))]
+        if perf is not None:
+            perf.add('step.actions', time.perf_counter() - start)
 
-        obs=[self.objects.normalize_obs*ob for ob in obs]
+        obs = self.get_obs()
 
-        return obs, rewards, done, {}
+        info = {}
+        if perf is not None:
+            perf.add('step', time.perf_counter() - start)
+            if perf.in_info:
+                info['perf'] = perf.current
+
+        return obs, rewards, done, info
 
     def gen_obs_grid(self):
         """
@@ -1345,25 +2094,185 @@ class MultiGridEnv(gym.Env):
             if not self.see_through_walls:
                 vis_mask = grid.process_vis(agent_pos=(a.view_size // 2, a.view_size - 1))
             else:
-                vis_mask = np.ones(shape=(grid.width, grid.height), dtype=np.bool)
+                vis_mask = np.ones(shape=(grid.width, grid.height), dtype=bool)
 
             grids.append(grid)
             vis_masks.append(vis_mask)
 
         return grids, vis_masks
 
-    def gen_obs(self):
+    def gen_obs(self, out=None):
         """
         Generate the agent's view (partially observable, low-resolution encoding)
+
+        :param out: uint8 array of shape (n_agents, view_size, view_size,
+            encode_dim) to write the views into, if all the agents have the
+            same view size
+        """
+
+        if self.objects is self.grid.world:
+            if self.see_through_walls:
+                return self.gen_window_obs(out)
+            encoding = self.grid.encoding
+        else:
+            # The grid planes are encoded in the grid's own world
+            encoding = self.grid.encode(self.objects)
+
+        return self._encode_obs(encoding, self.see_through_walls, out)
+
+    def _encode_obs(self, encoding, see_through_walls, out=None):
+        """
+        Gather and occlude the views of the agents from an encoding of the
+        grid in the env's world
         """
 
-        grids, vis_masks = self.gen_obs_grid()
+        wall = shared_obj(Wall, self.objects).encode(self.objects)
+
+        if out is not None:
+            return encode_views(
+                encoding,
+                self.grid.opaque,
+                [a.pos for a in self.agents],
+                [a.dir for a in self.agents],
+                self.agents[0].view_size,
+                wall,
+                see_through_walls=see_through_walls,
+                out=out,
+                perf=self.perf
+            )
 
-        # Encode the partially observable view into a numpy array
-        obs = [grid.encode_for_agents(self.objects, [grid.width // 2, grid.height - 1], vis_mask) for grid, vis_mask in zip(grids, vis_masks)]
+        # Encode the views of all the agents sharing a view size at once
+        obs = [None] * len(self.agents)
+        for view_size in set(a.view_size for a in self.agents):
+            ids = [i for i, a in enumerate(self.agents) if a.view_size == view_size]
+            views = encode_views(
+                encoding,
+                self.grid.opaque,
+                [self.agents[i].pos for i in ids],
+                [self.agents[i].dir for i in ids],
+                view_size,
+                wall,
+                see_through_walls=see_through_walls,
+                perf=self.perf
+            )
+            for i, view in zip(ids, views):
+                obs[i] = view
 
         return obs
 
+    def gen_window_obs(self, out=None):
+        """
+        Generate the views of the agents when they see through walls: no
+        occlusion is needed, so every view is copied directly out of a
+        rotated window of the padded encoding of the grid.
+
+        :param out: uint8 array of shape (n_agents, view_size, view_size,
+            encode_dim) to write the views into, if all the agents have the
+            same view size
+        """
+
+        # The windows are kept for the grid's own world only
+        if self.objects is not self.grid.world:
+            return self._encode_obs(self.grid.encode(self.objects), True, out)
+
+        perf = self.perf
+        if perf is not None:
+            start = time.perf_counter()
+
+        if out is not None:
+            obs = window_views(
+                self.grid.view_windows(self.agents[0].view_size),
+                [a.pos for a in self.agents],
+                [a.dir for a in self.agents],
+                out=out
+            )
+        else:
+            # The agents sharing a view size are copied at once
+            obs = [None] * len(self.agents)
+            for view_size in set(a.view_size for a in self.agents):
+                ids = [i for i, a in enumerate(self.agents) if a.view_size == view_size]
+                views = window_views(
+                    self.grid.view_windows(view_size),
+                    [self.agents[i].pos for i in ids],
+                    [self.agents[i].dir for i in ids]
+                )
+                for i, view in zip(ids, views):
+                    obs[i] = view
+
+        if perf is not None:
+            perf.add('obs.encode', time.perf_counter() - start)
+
+        return obs
+
+    def gen_full_obs(self, out=None):
+        """
+        Generate the full observations of the agents, as a (n_agents,
+        width, height, encode_dim) array. The grid is encoded once and
+        every agent only flags its own cell, as encode_for_agents does.
+
+        :param out: uint8 array to write the observations into
+        """
+
+        perf = self.perf
+        if perf is not None:
+            start = time.perf_counter()
+
+        encoding = self.grid.encoding if self.objects is self.grid.world else self.grid.encode(self.objects)
+
+        if out is None:
+            out = np.empty((len(self.agents),) + encoding.shape, dtype='uint8')
+        out[...] = encoding
+
+        if self.objects.encode_dim > 3:
+            pos = np.array([a.pos for a in self.agents])
+            out[np.arange(len(self.agents)), pos[:, 0], pos[:, 1], -1] = 1
+
+        if perf is not None:
+            perf.add('obs.encode', time.perf_counter() - start)
+
+        return out
+
+    def highlight_masks(self):
+        """
+        Lists of the agents seeing each cell, for the cells seen by at least
+        one agent, as a dict keyed by cell position
+        """
+
+        # The agents sharing a view size are processed as one batch
+        groups = {}
+        for i, a in enumerate(self.agents):
+            groups.setdefault(a.view_size, []).append(i)
+
+        seen_by, seen_xs, seen_ys = [], [], []
+        for view_size, ids in groups.items():
+            ids = np.array(ids)
+            pos = np.array([self.agents[i].pos for i in ids])
+            dirs = np.array([self.agents[i].dir for i in ids])
+            xs, ys = view_coords(pos, dirs, view_size)
+            if self.see_through_walls:
+                vis_mask = np.ones(xs.shape, dtype=bool)
+            else:
+                vis_mask = process_vis(gather_views(self.grid.opaque, xs, ys, True))
+
+            # Visible cells inside the grid
+            vis_mask &= (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+            seen_by.append(np.broadcast_to(ids[:, None, None], xs.shape)[vis_mask])
+            seen_xs.append(xs[vis_mask])
+            seen_ys.append(ys[vis_mask])
+
+        if not seen_by:
+            return {}
+
+        # The agents seeing a cell are listed in order
+        seen_by = np.concatenate(seen_by)
+        order = np.argsort(seen_by, kind='stable')
+
+        highlight_masks = {}
+        for i, x, y in zip(seen_by[order].tolist(), np.concatenate(seen_xs)[order].tolist(), np.concatenate(seen_ys)[order].tolist()):
+            highlight_masks.setdefault((x, y), []).append(i)
+
+        return highlight_masks
+
     def get_obs_render(self, obs, tile_size=TILE_PIXELS // 2):
         """
         Render an agent observation for visualization
@@ -1391,43 +2300,13 @@ class MultiGridEnv(gym.Env):
             return
 
         if mode == 'human' and not self.window:
+            # Matplotlib is only loaded when a window is needed
+            from .window import Window
             self.window = Window('gym_multigrid')
             self.window.show(block=False)
 
         if highlight:
-
-            # Compute which cells are visible to the agent
-            _, vis_masks = self.gen_obs_grid()
-
-            highlight_masks = {(i, j): [] for i in range(self.width) for j in range(self.height)}
-
-            for i, a in enumerate(self.agents):
-
-                # Compute the world coordinates of the bottom-left corner
-                # of the agent's view area
-                f_vec = a.dir_vec
-                r_vec = a.right_vec
-                top_left = a.pos + f_vec * (a.view_size - 1) - r_vec * (a.view_size // 2)
-
-                # Mask of which cells to highlight
-
-                # For each cell in the visibility mask
-                for vis_j in range(0, a.view_size):
-                    for vis_i in range(0, a.view_size):
-                        # If this cell is not visible, don't highlight it
-                        if not vis_masks[i][vis_i, vis_j]:
-                            continue
-
-                        # Compute the world coordinates of this cell
-                        abs_i, abs_j = top_left - (f_vec * vis_j) + (r_vec * vis_i)
-
-                        if abs_i < 0 or abs_i >= self.width:
-                            continue
-                        if abs_j < 0 or abs_j >= self.height:
-                            continue
-
-                        # Mark this cell to be highlighted
-                        highlight_masks[abs_i, abs_j].append(i)
+            highlight_masks = self.highlight_masks()
 
         # Render the whole grid
         img = self.grid.render(
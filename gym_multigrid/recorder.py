@@ -0,0 +1,302 @@
+import os
+import time
+import zlib
+import struct
+import queue
+import threading
+import numpy as np
+import gym
+from .multigrid import TILE_PIXELS
+
+# Size of the .npy headers of the frame stores, fixed so that the header
+# can be rewritten in place when the number of frames is known
+NPY_HEADER_SIZE = 128
+
+def npy_header(dtype, shape):
+    """
+    Header of a version 1.0 .npy file, padded to NPY_HEADER_SIZE bytes
+    """
+
+    header = repr({'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False, 'shape': tuple(shape)})
+    prefix = b'\x93NUMPY\x01\x00'
+    length = NPY_HEADER_SIZE - len(prefix) - 2
+    assert len(header) < length, header
+    header = header.ljust(length - 1) + '\n'
+
+    return prefix + struct.pack('<H', length) + header.encode('latin1')
+
+def encode_png(img, compress_level=1):
+    """
+    Encode a (height, width, 3) uint8 image as PNG bytes
+    """
+
+    height, width, _ = img.shape
+
+    # Every row starts with its filter type, 0 for none
+    raw = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+    raw[:, 1:] = img.reshape(height, width * 3)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)),
+        chunk(b'IDAT', zlib.compress(raw.tobytes(), compress_level)),
+        chunk(b'IEND', b'')
+    ])
+
+class NpyFrameStore:
+    """
+    Frames of an episode stored in a memory-mapped .npy file
+
+    The file is grown by doubling its capacity, and its header is rewritten
+    with the actual number of frames when the store is closed, so that it
+    can be read back with np.load (optionally with mmap_mode='r').
+    """
+
+    def __init__(self, path, frame_shape, dtype=np.uint8, capacity=64):
+        self.path = path
+        self.frame_shape = tuple(frame_shape)
+        self.dtype = np.dtype(dtype)
+        self.frame_size = int(np.prod(self.frame_shape)) * self.dtype.itemsize
+        self.n_frames = 0
+
+        self.file = open(path, 'w+b')
+        self.file.write(npy_header(self.dtype, (0,) + self.frame_shape))
+        self.frames = None
+        self._map(capacity)
+
+    def _map(self, capacity):
+        """
+        Resize the file to hold a number of frames and map it again
+        """
+
+        if self.frames is not None:
+            self.frames.flush()
+            del self.frames
+
+        self.capacity = capacity
+        self.file.truncate(NPY_HEADER_SIZE + capacity * self.frame_size)
+        self.frames = np.memmap(
+            self.file,
+            dtype=self.dtype,
+            mode='r+',
+            offset=NPY_HEADER_SIZE,
+            shape=(capacity,) + self.frame_shape
+        )
+
+    def write(self, frame):
+        if self.n_frames == self.capacity:
+            self._map(2 * self.capacity)
+
+        self.frames[self.n_frames] = frame
+        self.n_frames += 1
+
+    def close(self):
+        self.frames.flush()
+        del self.frames
+        self.frames = None
+
+        self.file.truncate(NPY_HEADER_SIZE + self.n_frames * self.frame_size)
+        self.file.seek(0)
+        self.file.write(npy_header(self.dtype, (self.n_frames,) + self.frame_shape))
+        self.file.close()
+
+class PngFrameStore:
+    """
+    Frames of an episode stored as a sequence of PNG files in a directory
+    """
+
+    def __init__(self, path, compress_level=1):
+        self.path = path
+        self.compress_level = compress_level
+        self.n_frames = 0
+
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, frame):
+        with open(os.path.join(self.path, '{:06d}.png'.format(self.n_frames)), 'wb') as f:
+            f.write(encode_png(frame, self.compress_level))
+        self.n_frames += 1
+
+    def close(self):
+        pass
+
+class FrameRecorder(gym.Wrapper):
+    """
+    Record the rgb_array frames of the episodes of an environment
+
+    The frames are rendered in the stepping thread and handed over to a
+    background thread through a bounded queue, the writer thread stores
+    them in one frame store per episode:
+    - 'npy': <directory>/episode_<n>.npy, memory-mapped while written
+    - 'png': <directory>/episode_<n>/<frame>.png
+    When the queue is full the stepping thread either waits for the writer
+    (block=True) or drops the frame, both are counted in stats().
+    """
+
+    def __init__(
+        self,
+        env,
+        directory,
+        format='npy',
+        highlight=False,
+        tile_size=TILE_PIXELS,
+        frame_skip=1,
+        max_queue=64,
+        block=True,
+        compress_level=1
+    ):
+        """
+        :param directory: directory to write the episodes into
+        :param format: 'npy' or 'png'
+        :param highlight: highlight the cells seen by the agents
+        :param frame_skip: record every frame_skip-th step, the first and
+            last frames of an episode are always recorded
+        :param max_queue: maximum number of frames waiting to be written
+        :param block: wait for the writer when the queue is full instead
+            of dropping frames
+        :param compress_level: zlib compression level of the PNG files
+        """
+
+        super().__init__(env)
+
+        assert format in ('npy', 'png'), format
+        assert frame_skip >= 1
+
+        self.directory = directory
+        self.format = format
+        self.highlight = highlight
+        self.tile_size = tile_size
+        self.frame_skip = frame_skip
+        self.block = block
+        self.compress_level = compress_level
+
+        os.makedirs(directory, exist_ok=True)
+
+        self.episode = -1
+        self.episode_steps = 0
+        self.recording = False
+
+        # Backpressure statistics
+        self.frames_queued = 0
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self.blocked_time = 0
+        self.max_queue_size = 0
+
+        self.error = None
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.thread = threading.Thread(target=self._writer, daemon=True)
+        self.thread.start()
+
+    def _writer(self):
+        store = None
+
+        while True:
+            cmd, data = self.queue.get()
+
+            try:
+                # After a failure the remaining frames are discarded
+                if cmd == 'frame' and self.error is None:
+                    episode, frame = data
+                    if store is None:
+                        store = self._open_store(episode, frame)
+                    store.write(frame)
+                    self.frames_written += 1
+
+                elif cmd in ('end', 'close') and store is not None:
+                    store.close()
+                    store = None
+
+            except Exception as e:
+                self.error = e
+
+            finally:
+                self.queue.task_done()
+
+            if cmd == 'close':
+                break
+
+    def _open_store(self, episode, frame):
+        name = 'episode_{:06d}'.format(episode)
+
+        if self.format == 'npy':
+            return NpyFrameStore(os.path.join(self.directory, name + '.npy'), frame.shape, frame.dtype)
+        return PngFrameStore(os.path.join(self.directory, name), self.compress_level)
+
+    def _put(self, item):
+        if self.error is not None:
+            raise RuntimeError('frame writer failed') from self.error
+
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            if item[0] == 'frame' and not self.block:
+                self.frames_dropped += 1
+                return
+            start = time.perf_counter()
+            self.queue.put(item)
+            self.blocked_time += time.perf_counter() - start
+
+        if item[0] == 'frame':
+            self.frames_queued += 1
+        self.max_queue_size = max(self.max_queue_size, self.queue.qsize())
+
+    def _record(self):
+        frame = self.env.render(mode='rgb_array', highlight=self.highlight, tile_size=self.tile_size)
+        self._put(('frame', (self.episode, frame)))
+
+    def _end_episode(self):
+        if self.recording:
+            self._put(('end', None))
+            self.recording = False
+
+    def reset(self, **kwargs):
+        obs = self.env.reset(**kwargs)
+
+        self._end_episode()
+        self.episode += 1
+        self.episode_steps = 0
+        self.recording = True
+        self._record()
+
+        return obs
+
+    def step(self, actions):
+        obs, rewards, done, info = self.env.step(actions)
+
+        self.episode_steps += 1
+        if self.recording and (done or self.episode_steps % self.frame_skip == 0):
+            self._record()
+        if done:
+            self._end_episode()
+
+        return obs, rewards, done, info
+
+    def flush(self):
+        """
+        Wait until all the queued frames are written
+        """
+
+        self.queue.join()
+        if self.error is not None:
+            raise RuntimeError('frame writer failed') from self.error
+
+    def stats(self):
+        return {
+            'frames_queued': self.frames_queued,
+            'frames_written': self.frames_written,
+            'frames_dropped': self.frames_dropped,
+            'blocked_time': self.blocked_time,
+            'queue_size': self.queue.qsize(),
+            'max_queue_size': self.max_queue_size
+        }
+
+    def close(self):
+        if self.thread.is_alive():
+            self.recording = False
+            self.queue.put(('close', None))
+            self.thread.join()
+        super().close()
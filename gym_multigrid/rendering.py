@@ -1,4 +1,5 @@
 import math
+from collections import OrderedDict
 import numpy as np
 
 def downsample(img, factor):
@@ -15,17 +16,36 @@ def downsample(img, factor):
 
     return img
 
+# Cache of the pixel center coordinates of images, keyed by image size
+_pixel_coords = {}
+
+def pixel_coords(height, width):
+    """
+    Coordinates of the pixel centers of an image, in [0, 1], as two
+    (height, width) arrays
+    """
+
+    key = (height, width)
+    if key not in _pixel_coords:
+        yf = (np.arange(height) + 0.5) / height
+        xf = (np.arange(width) + 0.5) / width
+        xs, ys = np.meshgrid(xf, yf)
+        xs.flags.writeable = False
+        ys.flags.writeable = False
+        _pixel_coords[key] = (xs, ys)
+
+    return _pixel_coords[key]
+
 def fill_coords(img, fn, color):
     """
     Fill pixels of an image with coordinates matching a filter function
+
+    The filter function is evaluated once on the arrays of coordinates of
+    all the pixels and returns a boolean mask.
     """
 
-    for y in range(img.shape[0]):
-        for x in range(img.shape[1]):
-            yf = (y + 0.5) / img.shape[0]
-            xf = (x + 0.5) / img.shape[1]
-            if fn(xf, yf):
-                img[y, x] = color
+    xs, ys = pixel_coords(img.shape[0], img.shape[1])
+    img[fn(xs, ys)] = color
 
     return img
 
@@ -55,19 +75,19 @@ def point_in_line(x0, y0, x1, y1, r):
 
     def fn(x, y):
         # Fast, early escape test
-        if x < xmin or x > xmax or y < ymin or y > ymax:
-            return False
+        near = (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
 
-        q = np.array([x, y])
-        pq = q - p0
+        pqx = x - p0[0]
+        pqy = y - p0[1]
 
         # Closest point on line
-        a = np.dot(pq, dir)
+        a = pqx * dir[0] + pqy * dir[1]
         a = np.clip(a, 0, dist)
-        p = p0 + a * dir
+        px = p0[0] + a * dir[0]
+        py = p0[1] + a * dir[1]
 
-        dist_to_line = np.linalg.norm(q - p)
-        return dist_to_line <= r
+        dist_to_line = np.sqrt((x - px) ** 2 + (y - py) ** 2)
+        return near & (dist_to_line <= r)
 
     return fn
 
@@ -78,7 +98,7 @@ def point_in_circle(cx, cy, r):
 
 def point_in_rect(xmin, xmax, ymin, ymax):
     def fn(x, y):
-        return x >= xmin and x <= xmax and y >= ymin and y <= ymax
+        return (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
     return fn
 
 def point_in_triangle(a, b, c):
@@ -86,25 +106,29 @@ def point_in_triangle(a, b, c):
     b = np.array(b)
     c = np.array(c)
 
+    v0 = c - a
+    v1 = b - a
+
+    # Compute dot products
+    dot00 = np.dot(v0, v0)
+    dot01 = np.dot(v0, v1)
+    dot11 = np.dot(v1, v1)
+
+    inv_denom = 1 / (dot00 * dot11 - dot01 * dot01)
+
     def fn(x, y):
-        v0 = c - a
-        v1 = b - a
-        v2 = np.array((x, y)) - a
+        v2x = x - a[0]
+        v2y = y - a[1]
 
-        # Compute dot products
-        dot00 = np.dot(v0, v0)
-        dot01 = np.dot(v0, v1)
-        dot02 = np.dot(v0, v2)
-        dot11 = np.dot(v1, v1)
-        dot12 = np.dot(v1, v2)
+        dot02 = v0[0] * v2x + v0[1] * v2y
+        dot12 = v1[0] * v2x + v1[1] * v2y
 
         # Compute barycentric coordinates
-        inv_denom = 1 / (dot00 * dot11 - dot01 * dot01)
         u = (dot11 * dot02 - dot01 * dot12) * inv_denom
         v = (dot00 * dot12 - dot01 * dot02) * inv_denom
 
         # Check if point is in triangle
-        return (u >= 0) and (v >= 0) and (u + v) < 1
+        return (u >= 0) & (v >= 0) & ((u + v) < 1)
 
     return fn
 
@@ -116,3 +140,84 @@ def highlight_img(img, color=(255, 255, 255), alpha=0.30):
     blend_img = img + alpha * (np.array(color, dtype=np.uint8) - img)
     blend_img = blend_img.clip(0, 255).astype(np.uint8)
     img[:, :, :] = blend_img
+
+class TileCache:
+    """
+    Bounded cache of rendered tiles with least recently used eviction
+
+    Keeps hit, miss and eviction counters so that the cache size can be
+    tuned for the number of highlight combinations of an environment.
+    """
+
+    def __init__(self, maxsize=4096):
+        """
+        :param maxsize: maximum number of tiles kept, None for no limit
+        """
+
+        self.maxsize = maxsize
+        self.tiles = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def __contains__(self, key):
+        return key in self.tiles
+
+    def get(self, key):
+        """
+        Return the tile stored under a key, or None, and count the lookup
+        """
+
+        img = self.tiles.get(key)
+        if img is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.tiles.move_to_end(key)
+        return img
+
+    def put(self, key, img):
+        """
+        Store a tile, evicting the least recently used ones if full
+        """
+
+        self.tiles[key] = img
+        self.tiles.move_to_end(key)
+
+        if self.maxsize is not None:
+            while len(self.tiles) > self.maxsize:
+                self.tiles.popitem(last=False)
+                self.evictions += 1
+
+    def resize(self, maxsize):
+        """
+        Change the size limit, evicting tiles if needed
+        """
+
+        self.maxsize = maxsize
+        if maxsize is not None:
+            while len(self.tiles) > maxsize:
+                self.tiles.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Drop all the tiles and reset the counters
+        """
+
+        self.tiles.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        return {
+            'size': len(self.tiles),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
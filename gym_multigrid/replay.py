@@ -0,0 +1,274 @@
+import os
+import numpy as np
+import gym
+from .multigrid import TILE_PIXELS
+
+def log_dtype(n):
+    """
+    Smallest unsigned integer type holding the values below n
+    """
+
+    return np.uint8 if n <= 1 << 8 else np.uint16 if n <= 1 << 16 else np.uint32
+
+class EpisodeLog:
+    """
+    Everything needed to replay an episode of a MultiGridEnv: how its
+    random stream was set at reset, its initial layout, and the actions
+    and agent orders of its steps. The steps only draw the order of the
+    agents, so the actions and orders replay them exactly.
+
+    The random stream is either the counter-based key and episode number
+    of an env seeded with an env_id, or the state of its generator before
+    the reset.
+    """
+
+    def __init__(self, rng_key, episode, rng_state, layout, agent_pos, agent_dir, actions, orders):
+        self.rng_key = rng_key
+        self.episode = episode
+        self.rng_state = rng_state
+        self.layout = layout
+        self.agent_pos = agent_pos
+        self.agent_dir = agent_dir
+        self.actions = actions
+        self.orders = orders
+
+    def __len__(self):
+        return len(self.actions)
+
+    def save(self, path):
+        """
+        Write the log into a compressed .npz file
+        """
+
+        arrays = {
+            'episode': np.array(self.episode),
+            'layout': self.layout,
+            'agent_pos': self.agent_pos,
+            'agent_dir': self.agent_dir,
+            'actions': self.actions,
+            'orders': self.orders
+        }
+
+        if self.rng_key is not None:
+            arrays['rng_key'] = np.array(self.rng_key, dtype=np.uint64)
+        else:
+            name, keys, pos, has_gauss, cached_gaussian = self.rng_state
+            arrays['rng_keys'] = keys
+            arrays['rng_pos'] = np.array((pos, has_gauss))
+            arrays['rng_gaussian'] = np.array(cached_gaussian)
+
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if 'rng_key' in data:
+                rng_key = tuple(int(k) for k in data['rng_key'])
+                rng_state = None
+            else:
+                rng_key = None
+                pos, has_gauss = data['rng_pos'].tolist()
+                rng_state = ('MT19937', data['rng_keys'], pos, has_gauss, float(data['rng_gaussian']))
+
+            return cls(
+                rng_key,
+                int(data['episode']),
+                rng_state,
+                data['layout'],
+                data['agent_pos'],
+                data['agent_dir'],
+                data['actions'],
+                data['orders']
+            )
+
+class EpisodeLogger(gym.Wrapper):
+    """
+    Log the episodes of an environment for EpisodeReplay, one compressed
+    <directory>/episode_<n>.npz file per episode, written when it ends or
+    when the next one starts.
+    """
+
+    def __init__(self, env, directory):
+        """
+        :param directory: directory to write the episodes into
+        """
+
+        super().__init__(env)
+
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        self.n_episodes = 0
+        self.log = None
+
+        # The agent orders are taken from the env as it draws them
+        unwrapped = env.unwrapped
+        draw_order = unwrapped._agent_order
+
+        def agent_order():
+            order = draw_order()
+            if self.log is not None:
+                self.log.orders.append(order)
+            return order
+
+        unwrapped._agent_order = agent_order
+
+    def _end_episode(self):
+        if self.log is None:
+            return
+
+        log, self.log = self.log, None
+        n_agents = len(self.env.unwrapped.agents)
+        log.actions = np.array(log.actions, dtype=log_dtype(self.env.action_space.n)).reshape(-1, n_agents)
+        log.orders = np.array(log.orders, dtype=log_dtype(n_agents)).reshape(-1, n_agents)
+
+        log.save(os.path.join(self.directory, 'episode_{:06d}.npz'.format(self.n_episodes)))
+        self.n_episodes += 1
+
+    def reset(self, **kwargs):
+        self._end_episode()
+
+        unwrapped = self.env.unwrapped
+        rng_state = unwrapped.np_random.get_state() if unwrapped.rng_key is None else None
+
+        obs = self.env.reset(**kwargs)
+
+        self.log = EpisodeLog(
+            unwrapped.rng_key,
+            unwrapped.episode,
+            rng_state,
+            unwrapped.grid.encoding.copy(),
+            np.array([a.pos for a in unwrapped.agents]),
+            np.array([a.dir for a in unwrapped.agents]),
+            [],
+            []
+        )
+
+        return obs
+
+    def step(self, actions):
+        if self.log is not None:
+            self.log.actions.append(np.asarray(actions))
+
+        obs, rewards, done, info = self.env.step(actions)
+
+        if done:
+            self._end_episode()
+
+        return obs, rewards, done, info
+
+    def close(self):
+        self._end_episode()
+        super().close()
+
+class EpisodeReplay:
+    """
+    Rebuild the states, observations and frames of a logged episode on
+    demand, by resetting an env of the same game as the logged one and
+    stepping it with the logged actions and agent orders. The state is
+    saved every checkpoint_every steps on the way, so that seeking back
+    restarts from the closest checkpoint.
+    """
+
+    def __init__(self, env, log, checkpoint_every=100):
+        """
+        :param env: env of the logged game, reset by the replay and used
+            by it only from then on
+        :param log: EpisodeLog, or path of the file of one
+        :param checkpoint_every: steps between two saved states
+        """
+
+        self.env = env.unwrapped
+        self.log = log if isinstance(log, EpisodeLog) else EpisodeLog.load(log)
+        self.checkpoint_every = checkpoint_every
+
+        env = self.env
+        if self.log.rng_key is not None:
+            env.rng_key = self.log.rng_key
+            env.episode = self.log.episode - 1
+        else:
+            # The reset draws from the restored generator, not from the
+            # counter-based streams the env may have been seeded with
+            env.rng_key = None
+            env.np_random.set_state(self.log.rng_state)
+        env.reset()
+
+        if not (np.array_equal(env.grid.encoding, self.log.layout)
+                and np.array_equal([a.pos for a in env.agents], self.log.agent_pos)
+                and np.array_equal([a.dir for a in env.agents], self.log.agent_dir)):
+            raise RuntimeError('the replayed episode does not start from the logged layout')
+
+        # The agents act in the logged order
+        env._agent_order = lambda: self.log.orders[env.step_count - 1]
+
+        self.checkpoints = {0: env.get_state()}
+
+    def __len__(self):
+        return len(self.log)
+
+    def _step(self):
+        """
+        Replay the next step, saving its state if it is a checkpoint
+        """
+
+        env = self.env
+        result = env.step(self.log.actions[env.step_count])
+
+        if env.step_count % self.checkpoint_every == 0 and env.step_count not in self.checkpoints:
+            self.checkpoints[env.step_count] = env.get_state()
+
+        return result
+
+    def seek(self, t):
+        """
+        Bring the env to its state after the first t steps
+        """
+
+        assert 0 <= t <= len(self), t
+
+        env = self.env
+        start = max(k for k in self.checkpoints if k <= t)
+
+        # Go on from the current state unless a checkpoint is closer
+        if not start <= env.step_count <= t:
+            env.set_state(self.checkpoints[start])
+
+        while env.step_count < t:
+            self._step()
+
+    def steps(self, start=0, stop=None):
+        """
+        Replay the steps from start to stop, yielding their observations,
+        rewards, dones and infos
+        """
+
+        self.seek(start)
+        stop = len(self) if stop is None else stop
+
+        while self.env.step_count < stop:
+            yield self._step()
+
+    def state(self, t):
+        """
+        Snapshot of the env after t steps, see MultiGridEnv.get_state()
+        """
+
+        self.seek(t)
+        return self.env.get_state()
+
+    def obs(self, t):
+        """
+        Observations of the agents after t steps
+        """
+
+        self.seek(t)
+        return self.env.get_obs()
+
+    def frame(self, t, highlight=False, tile_size=TILE_PIXELS):
+        """
+        rgb_array frame of the env after t steps
+        """
+
+        self.seek(t)
+        return self.env.render(mode='rgb_array', highlight=highlight, tile_size=tile_size)
@@ -0,0 +1,244 @@
+import os
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+import cloudpickle
+from .multigrid import MultiGridEnv
+
+
+class CloudpickleWrapper:
+    """
+    Serialize the env constructors with cloudpickle, so that lambdas and
+    closures can be sent to the workers
+    """
+
+    def __init__(self, x):
+        self.x = x
+
+    def __getstate__(self):
+        return cloudpickle.dumps(self.x)
+
+    def __setstate__(self, ob):
+        self.x = cloudpickle.loads(ob)
+
+
+class SharedArray:
+    """
+    Numpy array backed by a named shared memory block
+    """
+
+    def __init__(self, shape, dtype, name=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = max(int(np.prod(self.shape)) * self.dtype.itemsize, 1)
+
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+
+    def __getstate__(self):
+        return self.shape, self.dtype, self.shm.name
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def close(self):
+        del self.array
+        self.shm.close()
+
+
+def _worker(remote, parent_remote, env_fns, indices, buffers, cpu):
+    parent_remote.close()
+
+    if cpu is not None:
+        os.sched_setaffinity(0, [cpu])
+
+    envs = [fn() for fn in env_fns.x]
+    actions, obs, rewards, dones = [b.array for b in buffers]
+
+    # Let the envs write their observations straight into shared memory
+    for k, env in zip(indices, envs):
+        if isinstance(env, MultiGridEnv):
+            env.set_obs_buffer(obs[k])
+
+    try:
+        while True:
+            cmd, data = remote.recv()
+
+            if cmd == 'step':
+                infos = {}
+                for k, env in zip(indices, envs):
+                    ob, reward, done, info = env.step(actions[k])
+                    if done:
+                        info = dict(info, terminal_observation=np.array(ob))
+                        ob = env.reset()
+                    if ob is not getattr(env, 'obs_buffer', None):
+                        obs[k] = ob
+                    rewards[k] = reward
+                    dones[k] = done
+                    if info:
+                        infos[k] = info
+
+                # Only the non-empty infos go through the pipe
+                remote.send(infos)
+
+            elif cmd == 'reset':
+                for k, env in zip(indices, envs):
+                    ob = env.reset()
+                    if ob is not getattr(env, 'obs_buffer', None):
+                        obs[k] = ob
+                remote.send(None)
+
+            elif cmd == 'seed':
+                seed, counter_streams = data
+                if counter_streams:
+                    remote.send([env.seed(seed, env_id=k)[0] for k, env in zip(indices, envs)])
+                else:
+                    remote.send([env.seed(seed + k)[0] for k, env in zip(indices, envs)])
+
+            elif cmd == 'close':
+                break
+
+            else:
+                raise NotImplementedError(cmd)
+
+    finally:
+        for env in envs:
+            env.close()
+        for b in buffers:
+            b.close()
+        remote.close()
+
+
+class SubprocMultiGridEnv:
+    """
+    Pool of worker processes running copies of any MultiGridEnv.
+
+    Every worker steps a fixed slice of the envs and writes their
+    observations, rewards and dones straight into shared memory arrays
+    of shape (num_envs, n_agents, ...), (num_envs, n_agents) and
+    (num_envs,), so only the commands and the non-empty infos are
+    pickled. Envs are reset automatically when they are done, their last
+    observation is then in info['terminal_observation'].
+    """
+
+    def __init__(self, env_fns, envs_per_worker=1, pin_cpus=False, context=None, copy=True):
+        """
+        :param env_fns: list of functions building the envs
+        :param envs_per_worker: number of envs stepped by every worker
+        :param pin_cpus: pin every worker to its own core
+        :param context: multiprocessing start method
+        :param copy: return copies of the shared buffers instead of the
+            buffers themselves, which the next step overwrites
+        """
+
+        self.num_envs = len(env_fns)
+        self.copy = copy
+
+        # Probe the shapes of the buffers on a first env
+        env = env_fns[0]()
+        ob = np.asarray(env.reset())
+        self.n_agents = len(env.agents)
+        self.observation_space = env.observation_space
+        self.action_space = env.action_space
+        env.close()
+
+        self._buffers = [
+            SharedArray((self.num_envs, self.n_agents), np.int64),
+            SharedArray((self.num_envs,) + ob.shape, ob.dtype),
+            SharedArray((self.num_envs, self.n_agents), np.float64),
+            SharedArray((self.num_envs,), bool)
+        ]
+        self.actions, self.obs, self.rewards, self.dones = [b.array for b in self._buffers]
+
+        ctx = mp.get_context(context)
+        chunks = [
+            list(range(start, min(start + envs_per_worker, self.num_envs)))
+            for start in range(0, self.num_envs, envs_per_worker)
+        ]
+        cpus = sorted(os.sched_getaffinity(0)) if pin_cpus else None
+
+        self.remotes = []
+        self.processes = []
+        for w, indices in enumerate(chunks):
+            remote, work_remote = ctx.Pipe()
+            args = (
+                work_remote,
+                remote,
+                CloudpickleWrapper([env_fns[k] for k in indices]),
+                indices,
+                self._buffers,
+                cpus[w % len(cpus)] if cpus else None
+            )
+            process = ctx.Process(target=_worker, args=args, daemon=True)
+            process.start()
+            work_remote.close()
+
+            self.remotes.append(remote)
+            self.processes.append(process)
+
+        self.waiting = False
+        self.closed = False
+
+    def seed(self, seed, counter_streams=False):
+        """
+        Seed the env k with seed + k, or with seed(seed, env_id=k) to draw
+        its randomness from counter-based streams
+        """
+
+        for remote in self.remotes:
+            remote.send(('seed', (seed, counter_streams)))
+        return [s for remote in self.remotes for s in remote.recv()]
+
+    def reset(self):
+        for remote in self.remotes:
+            remote.send(('reset', None))
+        for remote in self.remotes:
+            remote.recv()
+
+        return self.obs.copy() if self.copy else self.obs
+
+    def step_async(self, actions):
+        assert not self.waiting, "step_wait must be called after step_async"
+
+        self.actions[:] = actions
+        for remote in self.remotes:
+            remote.send(('step', None))
+        self.waiting = True
+
+    def step_wait(self):
+        infos = [{} for _ in range(self.num_envs)]
+        for remote in self.remotes:
+            for k, info in remote.recv().items():
+                infos[k] = info
+        self.waiting = False
+
+        if self.copy:
+            return self.obs.copy(), self.rewards.copy(), self.dones.copy(), infos
+        return self.obs, self.rewards, self.dones, infos
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        if self.closed:
+            return
+
+        if self.waiting:
+            for remote in self.remotes:
+                remote.recv()
+        for remote in self.remotes:
+            remote.send(('close', None))
+        for process in self.processes:
+            process.join()
+
+        del self.actions, self.obs, self.rewards, self.dones
+        for b in self._buffers:
+            b.close()
+            b.shm.unlink()
+
+        self.closed = True
@@ -0,0 +1,426 @@
+import numpy as np
+from gym import spaces
+from gym.utils import seeding
+from .multigrid import Wall, counter_rng, shared_obj
+from .views import DIR_VECS, encode_views
+from .envs.collect_game import CollectGameEnv
+from .envs.soccer_game import SoccerGameEnv
+
+
+class VectorMultiGridEnv:
+    """
+    Batch of copies of a game stepped together in a single process.
+
+    The state of all the games is stacked in numpy arrays (struct of
+    arrays) and every step processes the i-th agent to act of all the
+    games at once. The rules are those of MultiGridEnv.step, with the
+    pickup and drop rules of the game the env is built from
+    (CollectGameEnv, SoccerGameEnv, or none for other envs).
+
+    Layouts are generated by the env built from `env_fn`, so the games
+    start from the same random layouts as that env. Games are reset
+    automatically when they are done, the observation returned for them
+    is then the first one of the new episode.
+
+    By default the order of the agents of all the games is drawn at once
+    from the generator of the batch, and the layouts of every game from a
+    generator of its own. A single env draws both from one generator, so
+    the games then only share their first layout with single envs. With
+    counter_streams, all the randomness of game k comes from
+    counter_rng(seed, k, episode, step), so that game k plays exactly as
+    an env seeded with seed(seed, env_id=k).
+    """
+
+    def __init__(self, env_fn, num_envs, seed=None, counter_streams=False):
+        self.env = env = env_fn()
+        self.num_envs = num_envs
+        self.counter_streams = counter_streams
+        self.n_agents = len(env.agents)
+
+        self.world = env.objects
+        self.actions = env.actions
+        self.action_space = env.action_space
+        self.width = env.width
+        self.height = env.height
+        self.max_steps = env.max_steps
+        self.partial_obs = env.partial_obs
+        self.see_through_walls = env.see_through_walls
+
+        if isinstance(env, SoccerGameEnv):
+            self.rules = 'soccer'
+        elif isinstance(env, CollectGameEnv):
+            self.rules = 'collect'
+        else:
+            self.rules = None
+
+        view_sizes = set(a.view_size for a in env.agents)
+        assert len(view_sizes) == 1, "all the agents must have the same view size"
+        self.view_size = view_sizes.pop()
+
+        if self.partial_obs:
+            obs_shape = (self.view_size, self.view_size, self.world.encode_dim)
+        else:
+            obs_shape = (self.width, self.height, self.world.encode_dim)
+        self.observation_space = spaces.Box(
+            low=0,
+            high=255,
+            shape=(num_envs, self.n_agents) + obs_shape,
+            dtype='uint8'
+        )
+
+        # Indices of the object types handled by the rules
+        idx = self.world.OBJECT_TO_IDX
+        self.EMPTY = idx['empty']
+        self.AGENT = idx['agent']
+        self.GOAL = idx.get('goal', -1)
+        self.OBJGOAL = idx.get('objgoal', -1)
+        self.BALL = idx.get('ball', -1)
+        self.PICKABLE = np.array([idx.get(t, -1) for t in ('key', 'ball', 'box')])
+        self.wall = shared_obj(Wall, self.world).encode(self.world)
+
+        # Team and color of every agent, and the reward given to every agent when
+        # _reward is called with a given key, as in the games
+        self.agent_index = np.array([a.index for a in env.agents])
+        self.agent_color = np.array([self.world.COLOR_TO_IDX[a.color] for a in env.agents])
+        keys = np.arange(max(self.n_agents, self.agent_index.max() + 1, len(self.world.COLOR_TO_IDX)))[:, None]
+        team = self.agent_index[None, :]
+        self.reward_table = ((team == keys) | (team == 0)).astype(float)
+        if getattr(env, 'zero_sum', False):
+            self.reward_table -= ((team != keys) | (team == 0))
+
+        shape = (num_envs, self.width, self.height)
+        # Grid planes
+        self.encoding = np.zeros(shape + (self.world.encode_dim,), dtype='uint8')
+        self.owner = np.zeros(shape, dtype='uint8')
+        self.opaque = np.zeros(shape, dtype=bool)
+        # Reward of the balls and goals, and target type of the goals
+        self.reward = np.zeros(shape)
+        self.target = np.zeros(shape, dtype='uint8')
+        # Agent in every cell, or -1
+        self.agent_at = np.full(shape, -1, dtype=np.int64)
+
+        shape = (num_envs, self.n_agents)
+        # Agent states
+        self.agent_pos = np.zeros(shape + (2,), dtype=np.int64)
+        self.agent_dir = np.zeros(shape, dtype=np.int64)
+        self.active = np.ones(shape, dtype=bool)
+        # Carried objects, type 0 when nothing is carried
+        self.carry_type = np.zeros(shape, dtype='uint8')
+        self.carry_color = np.zeros(shape, dtype='uint8')
+        self.carry_owner = np.zeros(shape, dtype='uint8')
+        self.carry_reward = np.zeros(shape)
+
+        self.step_count = np.zeros(num_envs, dtype=np.int64)
+        self.episode = np.zeros(num_envs, dtype=np.int64)
+        # Balls of every game at reset and left, collect games end when
+        # the balls they started with are all collected
+        self.initial_balls = np.zeros(num_envs, dtype=np.int64)
+        self.balls_left = np.zeros(num_envs, dtype=np.int64)
+
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        """
+        Seed the batch. With counter_streams, game k plays as an env seeded
+        with seed(seed, env_id=k). Otherwise the layouts of game k are
+        drawn from a generator seeded with seed + k: its first layout is
+        that of an env seeded with seed + k, the later ones differ as the
+        env also draws its agent orders from that generator
+        """
+
+        self.np_random, seed = seeding.np_random(seed)
+        self.episode[:] = -1
+
+        if self.counter_streams:
+            self.rng_seed = seed & 0xffffffffffffffff
+            return [seed] * self.num_envs
+
+        self.game_randoms = [seeding.np_random(seed + k)[0] for k in range(self.num_envs)]
+        return [seed + k for k in range(self.num_envs)]
+
+    def reset(self):
+        for k in range(self.num_envs):
+            self._reset_game(k)
+
+        return self.gen_obs()
+
+    def _reset_game(self, k):
+        """
+        Generate a new layout for game k with the layout generator of the env
+        """
+
+        self.episode[k] += 1
+
+        env = self.env
+        if self.counter_streams:
+            env.np_random = counter_rng(self.rng_seed, k, self.episode[k], 0)
+        else:
+            env.np_random = self.game_randoms[k]
+        env._gen_grid(env.width, env.height)
+        grid = env.grid
+
+        for a in env.agents:
+            a.carrying = None
+            grid.update(*a.pos)
+
+        self.encoding[k] = grid.encoding
+        self.owner[k] = grid.owner
+        self.opaque[k] = grid.opaque
+        self.reward[k] = 0
+        self.target[k] = 0
+        self.agent_at[k] = -1
+
+        for idx, v in enumerate(grid.grid):
+            if v is None:
+                continue
+            i, j = idx % grid.width, idx // grid.width
+            self.reward[k, i, j] = getattr(v, 'reward', 0)
+            if hasattr(v, 'target_type'):
+                self.target[k, i, j] = self.world.OBJECT_TO_IDX[v.target_type]
+
+        for n, a in enumerate(env.agents):
+            self.agent_pos[k, n] = a.pos
+            self.agent_dir[k, n] = a.dir
+            self.agent_at[k, a.pos[0], a.pos[1]] = n
+            self.active[k, n] = a.started and not a.terminated and not a.paused
+
+        self.carry_type[k] = 0
+        self.carry_color[k] = 0
+        self.carry_owner[k] = 0
+        self.carry_reward[k] = 0
+        self.step_count[k] = 0
+        self.initial_balls[k] = np.count_nonzero(self.encoding[k, :, :, 0] == self.BALL)
+        self.balls_left[k] = self.initial_balls[k]
+
+    def _agent_order(self):
+        """
+        Random order in which the agents of every game act
+        """
+
+        if self.counter_streams:
+            return np.array([
+                counter_rng(self.rng_seed, k, self.episode[k], self.step_count[k]).permutation(self.n_agents)
+                for k in range(self.num_envs)
+            ])
+
+        return np.argsort(self.np_random.rand(self.num_envs, self.n_agents), axis=1)
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        assert actions.shape == (self.num_envs, self.n_agents)
+
+        self.step_count += 1
+
+        rewards = np.zeros((self.num_envs, self.n_agents))
+        dones = np.zeros(self.num_envs, dtype=bool)
+
+        order = self._agent_order()
+        envs = np.arange(self.num_envs)
+
+        for k in range(self.n_agents):
+            a = order[:, k]
+            action = actions[envs, a]
+            action = np.where(self.active[envs, a], action, self.actions.still)
+
+            d = self.agent_dir[envs, a]
+            pos = self.agent_pos[envs, a]
+            fwd = pos + DIR_VECS[d]
+            fx = np.clip(fwd[:, 0], 0, self.width - 1)
+            fy = np.clip(fwd[:, 1], 0, self.height - 1)
+            fwd_type = self.encoding[envs, fx, fy, 0]
+
+            # Rotate left and right
+            turn = np.where(action == self.actions.left, -1, 0) + np.where(action == self.actions.right, 1, 0)
+            self.agent_dir[envs, a] = (d + turn) % 4
+
+            # Move forward
+            forward = action == self.actions.forward
+            goal = forward & (fwd_type == self.GOAL)
+            dones |= goal
+            self._give(rewards, goal, a, 1)
+
+            move = forward & (fwd_type == self.EMPTY)
+            e = envs[move]
+            self._move_agents(e, a[move], fwd[move])
+
+            if self.rules is not None:
+                pickup = action == self.actions.pickup
+                drop = action == self.actions.drop
+                fwd_agent = self.agent_at[envs, fx, fy]
+                if self.rules == 'collect':
+                    self._collect_pickup(rewards, pickup, a, fx, fy, fwd_type)
+                else:
+                    self._soccer_pickup(pickup, a, fx, fy, fwd_type, fwd_agent)
+                    self._soccer_drop(rewards, drop, a, fx, fy, fwd_type, fwd_agent)
+
+        self._encode_agents()
+
+        dones |= self.step_count >= self.max_steps
+        if self.rules == 'collect':
+            dones |= (self.initial_balls > 0) & (self.balls_left == 0)
+
+        infos = [{} for _ in range(self.num_envs)]
+        if dones.any():
+            obs = self.gen_obs()
+            for k in np.flatnonzero(dones):
+                infos[k]['terminal_observation'] = obs[k]
+                self._reset_game(k)
+            self._encode_agents()
+
+        return self.gen_obs(), rewards, dones, infos
+
+    def _give(self, rewards, mask, key, reward):
+        """
+        Reward the agents of the games selected by mask as the games do
+        when _reward is called with the given key
+        """
+
+        if not mask.any():
+            return
+
+        reward = reward[mask] if np.ndim(reward) else reward
+        rewards[mask] += self.reward_table[key[mask]] * np.reshape(reward, (-1, 1))
+
+    def _clear(self, e, x, y):
+        self.encoding[e, x, y] = 0
+        self.encoding[e, x, y, 0] = self.EMPTY
+        self.owner[e, x, y] = 0
+        self.opaque[e, x, y] = False
+        self.reward[e, x, y] = 0
+        self.target[e, x, y] = 0
+        self.agent_at[e, x, y] = -1
+
+    def _move_agents(self, e, a, fwd):
+        x, y = self.agent_pos[e, a].T
+        self._clear(e, x, y)
+
+        fx, fy = fwd.T
+        self.encoding[e, fx, fy] = 0
+        self.encoding[e, fx, fy, 0] = self.AGENT
+        self.owner[e, fx, fy] = self.agent_index[a]
+        self.agent_at[e, fx, fy] = a
+        self.agent_pos[e, a] = fwd
+
+    def _collect_pickup(self, rewards, pickup, a, fx, fy, fwd_type):
+        envs = np.arange(self.num_envs)
+        owner = self.owner[envs, fx, fy]
+
+        pick = pickup & np.isin(fwd_type, self.PICKABLE)
+        pick &= (owner == 0) | (owner == self.agent_index[a])
+
+        self._give(rewards, pick, a, self.reward[envs, fx, fy])
+        self.balls_left -= pick & (fwd_type == self.BALL)
+        self._clear(envs[pick], fx[pick], fy[pick])
+
+    def _soccer_pickup(self, pickup, a, fx, fy, fwd_type, fwd_agent):
+        envs = np.arange(self.num_envs)
+        free = self.carry_type[envs, a] == 0
+
+        # Pick up a ball from the ground
+        pick = pickup & free & np.isin(fwd_type, self.PICKABLE)
+        e, pa, x, y = envs[pick], a[pick], fx[pick], fy[pick]
+        self.carry_type[e, pa] = self.encoding[e, x, y, 0]
+        self.carry_color[e, pa] = self.encoding[e, x, y, 1]
+        self.carry_owner[e, pa] = self.owner[e, x, y]
+        self.carry_reward[e, pa] = self.reward[e, x, y]
+        self._clear(e, x, y)
+
+        # Take the ball from another agent
+        steal = pickup & free & (fwd_type == self.AGENT)
+        other = np.where(steal, fwd_agent, 0)
+        steal &= self.carry_type[envs, other] != 0
+        self._transfer(envs[steal], other[steal], a[steal])
+
+    def _soccer_drop(self, rewards, drop, a, fx, fy, fwd_type, fwd_agent):
+        envs = np.arange(self.num_envs)
+        carry_type = self.carry_type[envs, a]
+        drop = drop & (carry_type != 0)
+        owner = self.owner[envs, fx, fy]
+
+        # Score in a goal
+        score = drop & (fwd_type == self.OBJGOAL) & (self.target[envs, fx, fy] == carry_type)
+        score &= (self.carry_owner[envs, a] == 0) | (self.carry_owner[envs, a] == owner)
+        self._give(rewards, score, owner, self.reward[envs, fx, fy])
+        self._release(envs[score], a[score])
+
+        # Pass the ball to another agent
+        give = drop & (fwd_type == self.AGENT)
+        other = np.where(give, fwd_agent, 0)
+        give &= self.carry_type[envs, other] == 0
+        self._transfer(envs[give], a[give], other[give])
+
+        # Put the ball on the ground
+        put = drop & (fwd_type == self.EMPTY)
+        e, pa, x, y = envs[put], a[put], fx[put], fy[put]
+        self.encoding[e, x, y] = 0
+        self.encoding[e, x, y, 0] = self.carry_type[e, pa]
+        self.encoding[e, x, y, 1] = self.carry_color[e, pa]
+        self.owner[e, x, y] = self.carry_owner[e, pa]
+        self.reward[e, x, y] = self.carry_reward[e, pa]
+        self._release(e, pa)
+
+    def _transfer(self, e, src, dst):
+        self.carry_type[e, dst] = self.carry_type[e, src]
+        self.carry_color[e, dst] = self.carry_color[e, src]
+        self.carry_owner[e, dst] = self.carry_owner[e, src]
+        self.carry_reward[e, dst] = self.carry_reward[e, src]
+        self._release(e, src)
+
+    def _release(self, e, a):
+        self.carry_type[e, a] = 0
+        self.carry_color[e, a] = 0
+        self.carry_owner[e, a] = 0
+        self.carry_reward[e, a] = 0
+
+    def _encode_agents(self):
+        """
+        Write the encoding of every agent in its cell
+        """
+
+        x = self.agent_pos[:, :, 0]
+        y = self.agent_pos[:, :, 1]
+        e = np.arange(self.num_envs)[:, None]
+
+        cells = self.encoding[e, x, y]
+        cells[..., 0] = self.AGENT
+        cells[..., 1] = self.agent_color
+        if self.world.encode_dim > 3:
+            cells[..., 2] = self.carry_type
+            cells[..., 3] = self.carry_color
+            cells[..., 4] = self.agent_dir
+            cells[..., 5] = 0
+        else:
+            cells[..., 2] = self.agent_dir
+        self.encoding[e, x, y] = cells
+
+    def gen_obs(self):
+        """
+        Observations of all the agents of all the games, as an array of
+        shape (num_envs, n_agents, ...) of the single env observations
+        """
+
+        n = self.num_envs * self.n_agents
+
+        if not self.partial_obs:
+            obs = np.repeat(self.encoding[:, None], self.n_agents, axis=1)
+            if self.world.encode_dim > 3:
+                e = np.arange(self.num_envs)[:, None]
+                a = np.arange(self.n_agents)[None, :]
+                obs[e, a, self.agent_pos[:, :, 0], self.agent_pos[:, :, 1], -1] = 1
+            return obs
+
+        obs = encode_views(
+            self.encoding,
+            self.opaque,
+            self.agent_pos.reshape(n, 2),
+            self.agent_dir.reshape(n),
+            self.view_size,
+            self.wall,
+            see_through_walls=self.see_through_walls,
+            envs=np.repeat(np.arange(self.num_envs), self.n_agents)
+        )
+
+        return obs.reshape((self.num_envs, self.n_agents) + obs.shape[1:])
+
+    def close(self):
+        self.env.close()
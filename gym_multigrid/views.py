@@ -0,0 +1,313 @@
+import time
+import numpy as np
+
+# Forward vector of every agent direction
+DIR_VECS = np.array([(1, 0), (0, 1), (-1, 0), (0, -1)])
+
+# Cache of the view offset tables, keyed by view size
+_view_tables = {}
+
+def view_table(view_size):
+    """
+    Offsets from the agent position of the cells of its egocentric view,
+    as two (4, view_size, view_size) arrays indexed by direction and view
+    coordinates. The agent sits at (view_size // 2, view_size - 1).
+    """
+
+    if view_size in _view_tables:
+        return _view_tables[view_size]
+
+    vx, vy = np.meshgrid(np.arange(view_size), np.arange(view_size), indexing='ij')
+    fwd = view_size - 1 - vy
+    right = vx - view_size // 2
+
+    dx = np.empty((4, view_size, view_size), dtype=np.int64)
+    dy = np.empty((4, view_size, view_size), dtype=np.int64)
+    for d, (fx, fy) in enumerate(DIR_VECS):
+        rx, ry = -fy, fx
+        dx[d] = fx * fwd + rx * right
+        dy[d] = fy * fwd + ry * right
+
+    _view_tables[view_size] = (dx, dy)
+
+    return dx, dy
+
+def view_coords(pos, dirs, view_size):
+    """
+    Absolute coordinates of the view cells of a batch of agents, as two
+    (n, view_size, view_size) arrays
+    """
+
+    dx, dy = view_table(view_size)
+    pos = np.asarray(pos)
+
+    xs = pos[..., 0, None, None] + dx[dirs]
+    ys = pos[..., 1, None, None] + dy[dirs]
+
+    return xs, ys
+
+def gather_views(planes, xs, ys, fill, envs=None, out=None):
+    """
+    Gather the cells at the given coordinates from a (width, height, ...)
+    plane, or from a (n_envs, width, height, ...) batch of planes if the
+    env index of every view is given. Cells outside of the grid take the
+    fill value. The views are written into `out` if given.
+    """
+
+    width, height = planes.shape[(0 if envs is None else 1):][:2]
+
+    inside = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+
+    # Gather along the flattened cells, which is much faster than
+    # indexing with several coordinate arrays
+    cells = xs * height + ys
+    if envs is not None:
+        cells += (np.asarray(envs) * (width * height))[:, None, None]
+    outside = ~inside
+    cells[outside] = 0
+
+    flat = planes.reshape((-1,) + planes.shape[(2 if envs is None else 3):])
+    views = flat.take(cells, axis=0, out=out)
+    if outside.any():
+        views[outside] = fill
+
+    return views
+
+def process_vis(opaque, agent_pos=None):
+    """
+    Visibility masks of a batch of (..., width, height) views given which
+    of their cells can not be seen through. The agents are at the bottom
+    center of their views unless another position is given.
+
+    Visibility is propagated row by row from the bottom as in the original
+    cell by cell algorithm: within a row it spreads left then right from
+    the visible cells until it reaches an occluder (which is visible
+    itself), and every visible clear cell reveals its neighbours in the
+    row above. Small batches, like the views of the agents of one env,
+    are propagated cell by cell on Python lists. Larger ones do each step
+    of the propagation for the whole batch at once, which costs a fixed
+    number of numpy calls per cell of the view whatever the batch size.
+    """
+
+    shape = opaque.shape
+    width, height = shape[-2:]
+    opaque = opaque.reshape(-1, width, height)
+
+    if agent_pos is None:
+        # Small views are looked up in a precomputed table
+        if width * height <= MAX_SHADOW_CELLS:
+            bits = opaque.reshape(len(opaque), -1).dot(1 << np.arange(width * height))
+            return shadow_table(width, height)[bits].reshape(shape)
+
+        agent_pos = (width // 2, height - 1)
+
+    if len(opaque) <= MAX_SCALAR_VIS:
+        masks = np.array([vis_lists(view, agent_pos) for view in opaque.tolist()], dtype=bool)
+        return masks.reshape(shape)
+
+    # Work on (height, width, n) arrays so that every cell of a row is a
+    # contiguous vector over the batch
+    opaque = np.ascontiguousarray(opaque.transpose(2, 1, 0))
+    masks = np.zeros(opaque.shape, dtype=bool)
+    masks[agent_pos[1], agent_pos[0]] = True
+
+    # Visibility never spreads sideways in a single column
+    if width < 2:
+        return masks.transpose(2, 1, 0).reshape(shape)
+
+    clear = ~opaque
+
+    for j in reversed(range(0, height)):
+        row = masks[j]
+        lit = row & clear[j]
+
+        # Spread left to right, then right to left
+        for i in range(0, width - 1):
+            row[i + 1] |= lit[i]
+            lit[i + 1] = row[i + 1] & clear[j, i + 1]
+        for i in reversed(range(1, width)):
+            row[i - 1] |= lit[i]
+            lit[i - 1] = row[i - 1] & clear[j, i - 1]
+
+        if j > 0:
+            above = masks[j - 1]
+            above |= lit
+            above[1:] |= lit[:-1]
+            above[:-1] |= lit[1:]
+
+    return masks.transpose(2, 1, 0).reshape(shape)
+
+def vis_lists(opaque, agent_pos):
+    """
+    Visibility mask of a single view given as nested (width, height)
+    lists, with the original cell by cell algorithm
+    """
+
+    width, height = len(opaque), len(opaque[0])
+    mask = [[False] * height for _ in range(width)]
+    mask[agent_pos[0]][agent_pos[1]] = True
+
+    for j in reversed(range(0, height)):
+        for i in range(0, width - 1):
+            if not mask[i][j] or opaque[i][j]:
+                continue
+
+            mask[i + 1][j] = True
+            if j > 0:
+                mask[i + 1][j - 1] = True
+                mask[i][j - 1] = True
+
+        for i in reversed(range(1, width)):
+            if not mask[i][j] or opaque[i][j]:
+                continue
+
+            mask[i - 1][j] = True
+            if j > 0:
+                mask[i - 1][j - 1] = True
+                mask[i][j - 1] = True
+
+    return mask
+
+# Batches of at most this many views are processed view by view
+MAX_SCALAR_VIS = 12
+
+# Views with at most this many cells have their visibility masks tabulated
+MAX_SHADOW_CELLS = 12
+
+# Cache of the visibility mask of every occluder pattern, keyed by view shape
+_shadow_tables = {}
+
+def shadow_table(width, height):
+    """
+    Visibility masks of a view for all 2^(width * height) patterns of
+    occluders, indexed by the pattern bits in row-major (x, y) order
+    """
+
+    if (width, height) in _shadow_tables:
+        return _shadow_tables[width, height]
+
+    n = width * height
+    patterns = (np.arange(1 << n)[:, None] >> np.arange(n)) & 1
+    table = process_vis(patterns.astype(bool).reshape(-1, width, height), (width // 2, height - 1))
+
+    _shadow_tables[width, height] = table
+
+    return table
+
+# Batches of at most this many views are copied window by window, larger
+# ones are gathered at once
+MAX_WINDOW_COPIES = 16
+
+def rotated_windows(padded, pad, view_size):
+    """
+    Egocentric views of a given size of all the positions of a grid, over
+    its encoding padded with `pad` >= view_size - 1 cells of walls on
+    every side, for window_views().
+
+    Returns a (rotations, padded, offsets) tuple:
+    - rotations: one (windows, ox, oy) tuple per direction, where windows
+      is a read-only strided view of the padded buffer such that
+      windows[x + ox, y + oy] is the (view_size, view_size, encode_dim)
+      view of an agent at (x, y) facing that direction, already rotated
+    - padded: the padded buffer
+    - offsets: (4, view_size, view_size) offsets of the view cells in
+      the flattened buffer from the flat index x * padded height + y of
+      the agent, by direction
+    """
+
+    width, height, channels = padded.shape
+    s0, s1, s2 = padded.strides
+
+    # windows[i, j, a, b] = padded[i + a, j + b]
+    windows = np.lib.stride_tricks.as_strided(
+        padded,
+        shape=(width - view_size + 1, height - view_size + 1, view_size, view_size, channels),
+        strides=(s0, s1, s0, s1, s2),
+        writeable=False
+    )
+
+    dx, dy = view_table(view_size)
+    rotations = []
+
+    for d in range(4):
+        ox, oy = dx[d].min(), dy[d].min()
+        a, b = dx[d] - ox, dy[d] - oy
+        rotated = windows
+
+        # Make the view coordinates run along the window axes, the view
+        # is then windows[.., .., a, b]
+        if a[0, 0] == a[1, 0]:
+            rotated = rotated.swapaxes(2, 3)
+            a, b = b, a
+        if a[1, 0] < a[0, 0]:
+            rotated = rotated[:, :, ::-1]
+        if b[0, 1] < b[0, 0]:
+            rotated = rotated[:, :, :, ::-1]
+
+        rotations.append((rotated, int(ox) + pad, int(oy) + pad))
+
+    offsets = (dx + pad) * height + (dy + pad)
+
+    return rotations, padded, offsets
+
+def window_views(windows, pos, dirs, out=None):
+    """
+    Copy the views of a batch of agents out of the windows given by
+    rotated_windows(), into `out` if given. As in encode_views(), the
+    agents flag their own cell when the encoding has room for it.
+    """
+
+    rotations, padded, offsets = windows
+    pos = np.asarray(pos).reshape(-1, 2)
+    dirs = np.asarray(dirs).reshape(-1)
+
+    if len(dirs) > MAX_WINDOW_COPIES:
+        cells = padded.reshape(-1, padded.shape[-1])
+        out = cells.take((pos[:, 0] * padded.shape[1] + pos[:, 1])[:, None, None] + offsets[dirs], axis=0, out=out)
+
+    else:
+        if out is None:
+            out = np.empty((len(dirs),) + offsets.shape[1:] + padded.shape[-1:], dtype=padded.dtype)
+
+        for k, (x, y), d in zip(range(len(dirs)), pos.tolist(), dirs.tolist()):
+            rotated, ox, oy = rotations[d]
+            out[k] = rotated[x + ox, y + oy]
+
+    if out.shape[-1] > 3:
+        view_size = out.shape[1]
+        out[:, view_size // 2, view_size - 1, -1] = 1
+
+    return out
+
+def encode_views(encoding, opaque, pos, dirs, view_size, wall, see_through_walls=False, envs=None, out=None, perf=None):
+    """
+    Encode the egocentric views of a batch of agents in one gather.
+
+    Returns a (n, view_size, view_size, encode_dim) uint8 array with the
+    same layout as the encoding of the rotated grid slices: cells hidden
+    by occluders are zeroed and the agent flags its own cell when the
+    encoding has room for it. The views are written into `out` if given.
+    The gather and the visibility are timed into `perf` if given.
+    """
+
+    if perf is not None:
+        start = time.perf_counter()
+
+    xs, ys = view_coords(pos, dirs, view_size)
+    views = gather_views(encoding, xs, ys, wall, envs, out)
+
+    if perf is not None:
+        encoded = time.perf_counter()
+        perf.add('obs.encode', encoded - start)
+
+    if not see_through_walls:
+        vis_masks = process_vis(gather_views(opaque, xs, ys, True, envs))
+        views *= vis_masks[..., None]
+
+        if perf is not None:
+            perf.add('obs.visibility', time.perf_counter() - encoded)
+
+    if views.shape[-1] > 3:
+        views[:, view_size // 2, view_size - 1, -1] = 1
+
+    return views
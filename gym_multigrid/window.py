@@ -1,13 +1,14 @@
-import sys
 import numpy as np
 
-# Only ask users to install matplotlib if they actually need it
+# Only ask users to install matplotlib if they actually need it. This
+# module is only imported when rendering in human mode.
 try:
     import matplotlib.pyplot as plt
-except:
-    print('To display the environment in a window, please install matplotlib, eg:')
-    print('pip3 install --user matplotlib')
-    sys.exit(-1)
+except ImportError as e:
+    raise ImportError(
+        'To display the environment in a window, please install matplotlib, eg:\n'
+        'pip3 install --user matplotlib'
+    ) from e
 
 class Window:
     """
@@ -5,6 +5,6 @@ setup(name='gym_multigrid',
         packages=['gym_multigrid', 'gym_multigrid.envs'],
         install_requires=[
         'gym>=0.9.6',
-        'numpy>=1.15.0'
+        'numpy>=1.17.0'
         ]
 )
\ No newline at end of file
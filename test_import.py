@@ -0,0 +1,60 @@
+import sys
+import subprocess
+import argparse
+
+parser = argparse.ArgumentParser(description=None)
+parser.add_argument('-m', '--module', default='gym_multigrid.envs', type=str)
+parser.add_argument('-b', '--budget', default=1.0, type=float, help='import time budget in seconds')
+parser.add_argument('-r', '--repeat', default=5, type=int)
+
+# Run in a fresh interpreter, so that nothing is already imported
+PROBE = '''
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+print(int(any(m == 'matplotlib' or m.startswith('matplotlib.') for m in sys.modules)))
+'''
+
+def check_import(module, budget, repeat):
+    """
+    Import a module in fresh interpreters, and return the failure of the
+    check, or None if it passes
+    """
+
+    times = []
+
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, '-c', PROBE.format(module=module)],
+            check=True,
+            stdout=subprocess.PIPE,
+            universal_newlines=True
+        ).stdout.split()
+
+        times.append(float(out[0]))
+
+        if int(out[1]):
+            return 'importing {} loads matplotlib'.format(module)
+
+    best = min(times)
+    print('import {}: {:.3f}s (budget {:.3f}s)'.format(module, best, budget))
+
+    if best > budget:
+        return 'import time over budget'
+
+def test_import_time():
+    failure = check_import(parser.get_default('module'), parser.get_default('budget'), parser.get_default('repeat'))
+    assert failure is None, failure
+
+def main():
+
+    args = parser.parse_args()
+
+    failure = check_import(args.module, args.budget, args.repeat)
+    if failure is not None:
+        print('FAIL: ' + failure)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
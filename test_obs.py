@@ -0,0 +1,77 @@
+import numpy as np
+
+from gym_multigrid.multigrid import Agent, Grid, MultiGridEnv, SmallActions, SmallWorld, Wall, World
+from gym_multigrid.envs import CollectGame4HEnv10x10N2
+
+class SmallWorldEnv(MultiGridEnv):
+    """
+    Env of the SmallWorld objects generating its grid as the original
+    environments did, in the default world of Grid
+    """
+
+    def __init__(self, see_through_walls=False):
+        super().__init__(
+            width=8,
+            height=8,
+            max_steps=50,
+            see_through_walls=see_through_walls,
+            agents=[Agent(SmallWorld, i, view_size=5) for i in range(2)],
+            agent_view_size=5,
+            actions_set=SmallActions,
+            objects_set=SmallWorld
+        )
+
+    def _gen_grid(self, width, height):
+        self.grid = Grid(width, height)
+
+        self.grid.horz_wall(self.objects, 0, 0)
+        self.grid.horz_wall(self.objects, 0, height-1)
+        self.grid.vert_wall(self.objects, 0, 0)
+        self.grid.vert_wall(self.objects, width-1, 0)
+        self.grid.set(3, 3, Wall(World))
+        self.grid.set(4, 5, Wall(World))
+
+        for a in self.agents:
+            self.place_agent(a)
+
+def reference_obs(env):
+    """
+    Views of the agents encoded one by one from the sliced grids, as the
+    original gen_obs did
+    """
+
+    grids, vis_masks = env.gen_obs_grid()
+
+    return [grid.encode_for_agents(env.objects, [grid.width // 2, grid.height - 1], vis_mask) for grid, vis_mask in zip(grids, vis_masks)]
+
+def check_obs(env, steps, rng):
+    env.reset()
+
+    for t in range(steps):
+        env.step(rng.randint(0, env.action_space.n, size=len(env.agents)))
+
+        ref = reference_obs(env)
+        for obs in (env.gen_obs(), env.gen_obs(out=np.zeros((len(env.agents),) + env.observation_space.shape, dtype='uint8'))):
+            assert len(obs) == len(ref)
+            for o, r in zip(obs, ref):
+                assert o.shape == env.observation_space.shape, (t, o.shape)
+                assert np.array_equal(o, r), t
+
+def test_small_world():
+    rng = np.random.RandomState(0)
+
+    for see_through_walls in (False, True):
+        check_obs(SmallWorldEnv(see_through_walls), 50, rng)
+
+def test_world():
+    rng = np.random.RandomState(1)
+
+    for see_through_walls in (False, True):
+        env = CollectGame4HEnv10x10N2()
+        env.see_through_walls = see_through_walls
+        check_obs(env, 50, rng)
+
+if __name__ == "__main__":
+    test_small_world()
+    test_world()
+    print('gen_obs matches the views of gen_obs_grid')
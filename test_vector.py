@@ -0,0 +1,72 @@
+import numpy as np
+
+from gym_multigrid.envs import CollectGame4HEnv10x10N2, SoccerGame4HEnv10x15N2
+from gym_multigrid.vector_env import VectorMultiGridEnv
+from gym_multigrid.subproc_env import SubprocMultiGridEnv
+
+def single_envs(env_fn, n, seed, counter_streams, max_steps=None):
+    """
+    Single envs seeded as the envs of a batch
+    """
+
+    envs = []
+    for k in range(n):
+        env = env_fn()
+        if max_steps is not None:
+            env.max_steps = max_steps
+        if counter_streams:
+            env.seed(seed, env_id=k)
+        else:
+            env.seed(seed + k)
+        envs.append(env)
+
+    return envs
+
+def check_steps(batch, singles, steps, auto_reset, rng):
+    """
+    Step a batch and the matching single envs with the same actions
+    """
+
+    obs = batch.reset()
+    for k, env in enumerate(singles):
+        assert np.array_equal(obs[k], np.array(env.reset())), ('reset', k)
+
+    n_agents = len(singles[0].agents)
+
+    for t in range(steps):
+        actions = rng.randint(0, singles[0].action_space.n, size=(len(singles), n_agents))
+        obs, rewards, dones, infos = batch.step(actions)
+
+        for k, env in enumerate(singles):
+            o, r, d, _ = env.step(list(actions[k]))
+            assert np.array_equal(rewards[k], r), (t, k)
+            assert dones[k] == d, (t, k)
+            if d and auto_reset:
+                o = env.reset()
+            assert np.array_equal(obs[k], np.array(o)), (t, k)
+
+def test_vector_env():
+    rng = np.random.RandomState(0)
+
+    # Short episodes, so that the games are reset along the way
+    for env_fn in (SoccerGame4HEnv10x15N2, CollectGame4HEnv10x10N2):
+        batch = VectorMultiGridEnv(env_fn, 4, seed=10, counter_streams=True)
+        batch.max_steps = 40
+        check_steps(batch, single_envs(env_fn, 4, 10, True, max_steps=40), 200, True, rng)
+
+def test_subproc_env():
+    rng = np.random.RandomState(1)
+    n = 4
+
+    batch = SubprocMultiGridEnv([SoccerGame4HEnv10x15N2 for _ in range(n)], envs_per_worker=2)
+    try:
+        for counter_streams in (False, True):
+            batch.seed(7, counter_streams=counter_streams)
+            check_steps(batch, single_envs(SoccerGame4HEnv10x15N2, n, 7, counter_streams), 50, True, rng)
+    finally:
+        batch.close()
+
+if __name__ == "__main__":
+    test_vector_env()
+    test_subproc_env()
+    print('vector and subprocess envs match single envs')
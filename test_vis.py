@@ -0,0 +1,86 @@
+import numpy as np
+
+from gym_multigrid.views import MAX_SCALAR_VIS, MAX_SHADOW_CELLS, process_vis
+
+def reference_vis(opaque, agent_pos):
+    """
+    Visibility mask of a single view with the original cell by cell loop
+    of Grid.process_vis
+    """
+
+    width, height = opaque.shape
+    mask = np.zeros(shape=(width, height), dtype=bool)
+
+    mask[agent_pos[0], agent_pos[1]] = True
+
+    for j in reversed(range(0, height)):
+        for i in range(0, width - 1):
+            if not mask[i, j]:
+                continue
+
+            if opaque[i, j]:
+                continue
+
+            mask[i + 1, j] = True
+            if j > 0:
+                mask[i + 1, j - 1] = True
+                mask[i, j - 1] = True
+
+        for i in reversed(range(1, width)):
+            if not mask[i, j]:
+                continue
+
+            if opaque[i, j]:
+                continue
+
+            mask[i - 1, j] = True
+            if j > 0:
+                mask[i - 1, j - 1] = True
+                mask[i, j - 1] = True
+
+    return mask
+
+def check_batch(opaque, agent_pos=None):
+    masks = process_vis(opaque, agent_pos)
+    width, height = opaque.shape[-2:]
+    pos = (width // 2, height - 1) if agent_pos is None else agent_pos
+
+    for view, mask in zip(opaque, masks):
+        assert np.array_equal(mask, reference_vis(view, pos)), view.astype(int)
+
+def test_shadow_table():
+    rng = np.random.RandomState(0)
+
+    # Every view of at most MAX_SHADOW_CELLS cells is looked up
+    for width, height in [(3, 3), (3, 4), (2, 5), (1, 7)]:
+        assert width * height <= MAX_SHADOW_CELLS
+        check_batch(rng.rand(200, width, height) < rng.rand(200, 1, 1))
+
+def test_small_batches():
+    rng = np.random.RandomState(1)
+
+    for view_size in (5, 7, 9):
+        for n in (1, MAX_SCALAR_VIS):
+            for _ in range(20):
+                check_batch(rng.rand(n, view_size, view_size) < rng.rand())
+
+def test_large_batches():
+    rng = np.random.RandomState(2)
+
+    for width, height in [(7, 7), (5, 9), (11, 4)]:
+        n = 4 * MAX_SCALAR_VIS
+        check_batch(rng.rand(n, width, height) < rng.rand(n, 1, 1))
+
+def test_agent_pos():
+    rng = np.random.RandomState(3)
+
+    for n in (1, 4 * MAX_SCALAR_VIS):
+        check_batch(rng.rand(n, 6, 6) < 0.3, (2, 4))
+        check_batch(rng.rand(n, 3, 3) < 0.3, (0, 1))
+
+if __name__ == "__main__":
+    test_shadow_table()
+    test_small_batches()
+    test_large_batches()
+    test_agent_pos()
+    print('process_vis matches the cell by cell algorithm')